@@ -10,7 +10,20 @@ import time
 import platform
 import psutil
 import random
-from typing import Optional
+import tempfile
+import sqlite3
+import zipfile
+import hashlib
+import mmap
+import re
+import heapq
+import urllib.parse
+import aiohttp
+from aiohttp import web
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from abc import ABC, abstractmethod
+from typing import Optional, Union
 
 # Bot configuration
 intents = discord.Intents.default()
@@ -19,88 +32,2179 @@ intents.members = True
 intents.presences = True
 intents.reactions = True
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+class DMInteractorBot(commands.AutoShardedBot):
+    async def setup_hook(self):
+        """Start background workers and restore saved sessions before connecting"""
+        global panel_view
+        panel_view = PanelView()
+        self.add_view(panel_view)
+        transcript_writer.start()
+        attachment_cache.start()
+        metrics_sampler.start()
+        config_watcher.start()
+        # With a shared session store, the process running shard 0 expires sessions for all of them
+        if not session_store.shared or config['shard_ids'] is None or 0 in config['shard_ids']:
+            session_reaper.start()
+        await metrics_server.start()
+        await guild_config.load()
+        await restore_sessions()
+        await session_store.listen(apply_session_event)
+
+    async def close(self):
+        """Release relay resources before disconnecting"""
+        await metrics_sampler.close()
+        await config_watcher.close()
+        await session_reaper.close()
+        await metrics_server.close()
+        await transcript_writer.close()
+        await close_http_session()
+        await attachment_cache.close()
+        await message_map_spill.close()
+        await session_store.close()
+        await guild_config.close()
+        await super().close()
+
+# Admin check decorator
+def is_admin():
+    async def predicate(ctx):
+        if not isinstance(ctx.channel, discord.TextChannel):
+            return False
+        return await check_admin(ctx.guild, ctx.author)
+    return commands.check(predicate)
+
+# Store active DM channels and their configurations
+active_dms = {}  # {author_id: {'user': target_user, 'channel': channel, 'dm_channel': dm_channel, 'message_map': MessageMap}}
+
+# Partial DM message handles kept per session for reaction mirroring
+PARTIAL_MESSAGE_CACHE_SIZE = 256
+
+# Reverse index of target users to the admins messaging them
+dm_targets = {}  # {target_user_id: {author_id, ...}}
+
+# Cached administrator status, invalidated by member and role gateway events
+admin_cache = {}  # {guild_id: {member_id: (is_admin, expires_at)}}
+
+# Members fetched on demand when the gateway cache does not have them
+member_cache = OrderedDict()  # {(guild_id, member_id): (member, expires_at)}
+
+# Users fetched from the API, and lookups still waiting on it
+user_cache = OrderedDict()  # {user_id: (user, expires_at)}
+user_lookups = {}  # {user_id: asyncio.Task}
+
+# Ensure directories exist
+os.makedirs('logs', exist_ok=True)
+os.makedirs('files', exist_ok=True)
+
+# Default configuration
+DEFAULT_CONFIG = {
+    'prefix': '!',
+    'default_logging': True,
+    'max_file_size': 8388608,  # 8MB
+    'attachment_spool_size': 1048576,  # Attachments larger than 1MB are spooled to a temp file
+    'attachment_inflight_budget': 67108864,  # 64MB of attachment buffers across all relays
+    'attachment_cache_size': 268435456,  # 256MB of downloaded attachments kept in files/ for re-sending; 0 disables
+    'download_concurrency': 8,  # Attachment downloads running at once across all sessions
+    'session_download_concurrency': 4,  # Attachment downloads running at once per session
+    'message_map_size': 10000,  # Message mappings kept in memory per session
+    'message_map_spill': True,  # Keep evicted mappings on disk so old reactions still mirror
+    'persist_sessions': True,  # Save sessions and their message maps so they survive restarts
+    'session_store': 'local',  # 'local' (SQLite) or a redis://host:port URL shared by all bot processes
+    'shard_count': None,  # Total shards across all processes (None lets Discord decide)
+    'shard_ids': None,  # Shards run by this process, e.g. [0, 1] (None runs all of them)
+    'relay_rate': 1.0,  # Relayed messages per second to one channel or user once the burst is used; 0 disables pacing
+    'relay_burst': 5,  # Relayed messages sent back to back to one channel or user
+    'inbound_coalesce_window': 0,  # Seconds to gather a target's rapid DMs into one embed; 0 relays each on its own
+    'broadcast_concurrency': 10,  # Broadcast recipients being delivered to at once
+    'broadcast_rate': 40,  # Broadcast API calls per second across all broadcasts; 0 disables pacing
+    'metrics_interval': 5,  # Seconds between metrics samples
+    'metrics_window': 12,  # Samples averaged in the status command
+    'metrics_history': 120,  # Samples kept for sparklines and averages
+    'metrics_port': None,  # Port for the /metrics HTTP endpoint; None disables it
+    'metrics_host': '127.0.0.1',  # Address the /metrics endpoint listens on
+    'transcript_queue_size': 10000,  # Transcript entries waiting to be written before relays wait
+    'transcript_batch_size': 500,  # Transcript entries written per batch
+    'transcript_fsync_interval': 5,  # Seconds between transcript fsyncs
+    'session_idle_ttl': 3600,  # Seconds without relayed messages before a session ends; None disables
+    'session_max_ttl': 86400,  # Seconds after which a session ends regardless of activity; None disables
+    'admin_cache_ttl': 300,  # Seconds before a cached admin check is refreshed
+    'lean_gateway': False,  # Skip presences, member caching and startup chunking (needs a restart)
+    'member_cache_size': 1000,  # Members fetched on demand that are kept in memory
+    'member_cache_ttl': 300,  # Seconds before a member fetched on demand is fetched again
+    'user_cache_size': 1000,  # Users fetched from the API that are kept in memory
+    'user_cache_ttl': 300,  # Seconds before a fetched user is fetched again
+    'guild_config_cache_size': 1000,  # Guilds whose own settings are kept in memory
+    'config_reload_interval': 2,  # Seconds between checks of config.json for outside edits
+    'allowed_file_types': ['.txt', '.png', '.jpg', '.jpeg', '.gif', '.mp4', '.pdf', '.zip', '.docx', '.xlsx']  # Extended file types
+}
+
+# Helper functions
+def format_duration(seconds):
+    """Format seconds into human readable time"""
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    days, hours = divmod(hours, 24)
+    
+    parts = []
+    if days > 0:
+        parts.append(f"{int(days)}d")
+    if hours > 0:
+        parts.append(f"{int(hours)}h")
+    if minutes > 0:
+        parts.append(f"{int(minutes)}m")
+    if seconds > 0 or not parts:
+        parts.append(f"{int(seconds)}s")
+    
+    return " ".join(parts)
+
+def get_system_info():
+    """Get system information; CPU and memory usage come from the metrics sampler"""
+    return {
+        'os': platform.system(),
+        'python_version': platform.python_version(),
+        'discord_version': discord.__version__,
+        'uptime': time.time() - psutil.boot_time()
+    }
+
+async def check_admin(guild, member):
+    """Check if a member is an administrator, using the admin cache when possible"""
+    now = time.monotonic()
+    # In lean gateway mode no member update events arrive to invalidate the admin
+    # cache, but messages and commands carry the member's current roles
+    if config['lean_gateway'] and isinstance(member, discord.Member):
+        admin_checks.inc(result='direct')
+        return member.guild_permissions.administrator
+
+    guild_cache = admin_cache.setdefault(guild.id, {})
+    cached = guild_cache.get(member.id)
+    if cached and cached[1] > now:
+        admin_checks.inc(result='hit')
+        admin_check_seconds.observe(time.monotonic() - now)
+        return cached[0]
+    admin_checks.inc(result='miss')
+
+    # Messages and commands from a guild already carry the member's roles
+    member_id = member.id
+    if not isinstance(member, discord.Member):
+        member = await resolve_member(guild, member_id)
+        if member is None:
+            return False
+
+    result = member.guild_permissions.administrator
+    guild_cache[member_id] = (result, now + config['admin_cache_ttl'])
+    admin_check_seconds.observe(time.monotonic() - now)
+    return result
+
+async def resolve_member(guild, member_id):
+    """Get a guild member from the gateway cache, the bounded member cache, or the API"""
+    member = guild.get_member(member_id)
+    if member is not None:
+        return member
+
+    key = (guild.id, member_id)
+    now = time.monotonic()
+    cached = member_cache.get(key)
+    if cached and cached[1] > now:
+        member_cache.move_to_end(key)
+        return cached[0]
+
+    try:
+        member = await guild.fetch_member(member_id)
+    except discord.NotFound:
+        member_cache.pop(key, None)
+        return None
+    member_cache[key] = (member, now + config['member_cache_ttl'])
+    if len(member_cache) > config['member_cache_size']:
+        member_cache.popitem(last=False)
+    return member
+
+async def resolve_user(user_id):
+    """Get a user from the gateway cache, the bounded user cache, or the API
+
+    Concurrent lookups of the same user share a single API request. Raises
+    discord.NotFound like fetch_user when the user does not exist.
+    """
+    user = bot.get_user(user_id)
+    if user is not None:
+        return user
+
+    cached = user_cache.get(user_id)
+    if cached and cached[1] > time.monotonic():
+        user_cache.move_to_end(user_id)
+        return cached[0]
+
+    lookup = user_lookups.get(user_id)
+    if lookup is None:
+        lookup = asyncio.create_task(fetch_user(user_id))
+        user_lookups[user_id] = lookup
+    # Shielded so a cancelled command does not cancel the lookup for the others
+    return await asyncio.shield(lookup)
+
+async def fetch_user(user_id):
+    """Fetch a user from the API into the user cache"""
+    try:
+        user = await bot.fetch_user(user_id)
+    except discord.NotFound:
+        user_cache.pop(user_id, None)
+        raise
+    finally:
+        user_lookups.pop(user_id, None)
+    user_cache[user_id] = (user, time.monotonic() + config['user_cache_ttl'])
+    if len(user_cache) > config['user_cache_size']:
+        user_cache.popitem(last=False)
+    return user
+
+def invalidate_admin(guild_id, member_id=None):
+    """Drop cached admin status for a member, or for a whole guild"""
+    if member_id is None:
+        admin_cache.pop(guild_id, None)
+    elif guild_id in admin_cache:
+        admin_cache[guild_id].pop(member_id, None)
+
+# Load configuration
+def load_config():
+    try:
+        with open('config.json', 'r') as f:
+            loaded_config = json.load(f)
+            # Update with any missing default values
+            for key, value in DEFAULT_CONFIG.items():
+                if key not in loaded_config:
+                    loaded_config[key] = value
+    except FileNotFoundError:
+        loaded_config = DEFAULT_CONFIG.copy()
+        # Save the default config
+        write_config_file(loaded_config)
+    return loaded_config
+
+def write_config_file(data):
+    """Write config.json atomically so the watcher and backups never read a partial file"""
+    fd, temp_path = tempfile.mkstemp(dir='.', prefix='config.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, 'config.json')
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return config_file_signature()
+
+def config_file_signature():
+    """Modification time and size of config.json, or None if it is missing"""
+    try:
+        stat = os.stat('config.json')
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+# Config reloads run one at a time, in order, off the event loop
+config_executor = ThreadPoolExecutor(max_workers=1)
+
+# Cached renderings of static command output, rebuilt whenever the config changes
+config_version = 0
+render_cache = {}  # {key: (config_version, version, rendering)}
+
+def cached_render(key, render, version=None):
+    """Return a cached rendering, rebuilding it after a config change or when version changes"""
+    cached = render_cache.get(key)
+    if cached is None or cached[0] != config_version or cached[1] is not version:
+        cached = render_cache[key] = (config_version, version, render())
+    return cached[2]
+
+config = load_config()
+
+# Instrumentation
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+def format_labels(labels):
+    """Render a sorted label tuple in exposition format"""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+class Counter:
+    """Monotonic counter, one value per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.values = {}  # {labels: value}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield f"{self.name}_total{format_labels(labels)} {value}"
+
+class Gauge:
+    """Value read from a callback whenever metrics are collected"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, read):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+
+    def samples(self):
+        yield f"{self.name} {self.read()}"
+
+class HistogramTimer:
+    """Observe the time spent in a with block"""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+class Histogram:
+    """Latency histogram with cumulative buckets, one series per label set"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.values = {}  # {labels: [bucket counts..., +Inf count, sum]}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+        series[-2] += 1
+        series[-1] += value
+
+    def time(self, **labels):
+        return HistogramTimer(self, labels)
+
+    def summary(self):
+        """Yield (labels, count, average) for each series"""
+        for labels, series in self.values.items():
+            yield labels, series[-2], series[-1] / series[-2]
+
+    def samples(self):
+        for labels, series in self.values.items():
+            bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+            for bound, count in zip(bounds, series):
+                yield f"{self.name}_bucket{format_labels(labels + (('le', bound),))} {count}"
+            yield f"{self.name}_count{format_labels(labels)} {series[-2]}"
+            yield f"{self.name}_sum{format_labels(labels)} {series[-1]}"
+
+class MetricsRegistry:
+    """Collection of metrics rendered in the OpenMetrics text format"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation):
+        return self.register(Counter(name, documentation))
+
+    def gauge(self, name, documentation, read):
+        return self.register(Gauge(name, documentation, read))
+
+    def histogram(self, name, documentation, buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.extend(metric.samples())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+registry = MetricsRegistry()
+dispatch_seconds = registry.histogram('dm_dispatch_seconds', "Time spent handling a message in on_message, by route")
+admin_check_seconds = registry.histogram('dm_admin_check_seconds', "Time spent checking administrator status")
+admin_checks = registry.counter('dm_admin_checks', "Administrator checks by admin cache result")
+download_seconds = registry.histogram('dm_attachment_download_seconds', "Time spent downloading an attachment from the CDN")
+download_bytes = registry.counter('dm_attachment_download_bytes', "Attachment bytes downloaded from the CDN")
+relay_send_seconds = registry.histogram('dm_relay_send_seconds', "Time spent sending a relayed message, by payload kind")
+upload_bytes = registry.counter('dm_attachment_upload_bytes', "Attachment bytes uploaded in relayed messages")
+attachment_cache_lookups = registry.counter('dm_attachment_cache_lookups', "Attachment cache lookups by result")
+reaction_seconds = registry.histogram('dm_reaction_mirror_seconds', "Time spent mirroring a reaction, by action")
+reaction_errors = registry.counter('dm_reaction_mirror_errors', "Reactions that could not be mirrored, by action")
+rest_seconds = registry.histogram('dm_rest_request_seconds', "Discord REST request latency, including each retry")
+rest_responses = registry.counter('dm_rest_responses', "Discord REST responses by status; 429 and 5xx responses are retried")
+registry.gauge('dm_active_sessions', "Active DM and broadcast sessions", lambda: len(active_dms))
+registry.gauge(
+    'dm_message_map_entries', "Message mappings held in memory across sessions",
+    lambda: sum(len(dm_info['message_map'].forward) for dm_info in active_dms.values() if 'message_map' in dm_info)
+)
+registry.gauge('dm_attachment_cache_bytes', "Bytes of attachments kept in the attachment cache", lambda: attachment_cache.total)
+
+async def trace_request_start(session, context, params):
+    context.started = time.perf_counter()
+
+async def trace_request_end(session, context, params):
+    rest_seconds.observe(time.perf_counter() - context.started)
+    rest_responses.inc(status=params.response.status)
+
+# Every REST call discord.py makes, including its own 429 and 5xx retries, passes through here
+http_trace = aiohttp.TraceConfig()
+http_trace.on_request_start.append(trace_request_start)
+http_trace.on_request_end.append(trace_request_end)
+
+async def serve_metrics(request):
+    return web.Response(body=registry.render().encode(), headers={'Content-Type': METRICS_CONTENT_TYPE})
+
+class MetricsServer:
+    """Optional local HTTP endpoint for scraping metrics, enabled by metrics_port"""
+
+    def __init__(self):
+        self.runner = None
+
+    async def start(self):
+        if config['metrics_port'] is None or self.runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', serve_metrics)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, config['metrics_host'], config['metrics_port']).start()
+
+    async def close(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+metrics_server = MetricsServer()
+
+def file_size(file):
+    """Bytes left to read in a discord.File, without consuming it"""
+    position = file.fp.tell()
+    size = file.fp.seek(0, io.SEEK_END)
+    file.fp.seek(position)
+    return size - position
+
+def close_files(files):
+    """Close discord.File objects and their buffers, which discord.py leaves open"""
+    for file in files:
+        # discord.File stubs out fp.close until it is closed itself
+        file.close()
+        file.fp.close()
+
+# Resolve the command prefix for the guild a message was sent in
+async def resolve_prefix(bot, message):
+    return (await guild_config.get(message.guild)).prefix
+
+# Lean gateway mode drops presences and the member cache; members are fetched on demand
+if config['lean_gateway']:
+    intents.presences = False
+
+# DMs always arrive on shard 0; with several processes, exactly one must run it
+bot = DMInteractorBot(
+    command_prefix=resolve_prefix,
+    intents=intents,
+    member_cache_flags=discord.MemberCacheFlags.none() if config['lean_gateway'] else discord.MemberCacheFlags.from_intents(intents),
+    chunk_guilds_at_startup=not config['lean_gateway'],
+    shard_count=config['shard_count'],
+    shard_ids=config['shard_ids'],
+    http_trace=http_trace
+)
 bot.remove_command('help')
 
-# Admin check decorator
-def is_admin():
-    async def predicate(ctx):
-        if not isinstance(ctx.channel, discord.TextChannel):
-            return False
-        return ctx.author.guild_permissions.administrator
-    return commands.check(predicate)
+# SQLite-backed stores
+class SQLiteStore:
+    """A SQLite database used only from its own worker thread, so queries never block the event loop
+
+    The database is opened on first use; subclasses create their tables in
+    _setup.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def _setup(self, db):
+        """Create tables and indexes when the database is opened"""
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._setup(self._db)
+        return self._db
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _execute(self, sql, args=()):
+        db = self._connect()
+        with db:
+            return db.execute(sql, args).fetchall()
+
+    async def close(self):
+        if self._db is not None:
+            await self._run(self._db.close)
+            self._db = None
+
+# Per-guild configuration
+GUILD_CONFIG_KEYS = ('prefix', 'allowed_file_types', 'max_file_size')
+
+class GuildSettings:
+    """Effective prefix and attachment rules for a guild, precompiled for per-message checks"""
+
+    __slots__ = ('prefix', 'allowed_file_types', 'allowed_extensions', 'max_file_size')
+
+    def __init__(self, overrides=None):
+        settings = {key: config[key] for key in GUILD_CONFIG_KEYS}
+        settings.update(overrides or {})
+        self.prefix = settings['prefix']
+        self.allowed_file_types = settings['allowed_file_types']
+        self.allowed_extensions = frozenset(ext.lower() for ext in self.allowed_file_types)
+        self.max_file_size = settings['max_file_size']
+
+class GuildConfigStore(SQLiteStore):
+    """Per-guild overrides of the prefix and attachment rules, persisted to SQLite
+
+    Each guild's overrides are one compact JSON row. The IDs of guilds with
+    overrides are indexed in memory, so guilds on the global config never
+    reach the database; settings for the others are loaded on first use and
+    kept in an LRU of guild_config_cache_size guilds.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.overridden = set()
+        self.cache = OrderedDict()  # {guild_id: GuildSettings}
+        self.defaults = None
+
+    def _setup(self, db):
+        db.execute('CREATE TABLE IF NOT EXISTS guild_config (guild_id INTEGER PRIMARY KEY, overrides TEXT NOT NULL)')
+
+    async def load(self):
+        """Index the guilds that have overrides"""
+        rows = await self._run(self._execute, 'SELECT guild_id FROM guild_config')
+        self.overridden = {guild_id for guild_id, in rows}
+        self.cache.clear()
+
+    def reset(self):
+        """Rebuild resolved settings after the global config changes"""
+        self.defaults = GuildSettings()
+        self.cache.clear()
+
+    async def get(self, guild):
+        """Settings for a guild, or the global settings for None"""
+        guild_id = guild.id if guild is not None else None
+        if guild_id not in self.overridden:
+            return self.defaults
+        settings = self.cache.get(guild_id)
+        if settings is not None:
+            self.cache.move_to_end(guild_id)
+            return settings
+
+        settings = self.cache[guild_id] = GuildSettings(await self.overrides(guild_id))
+        if len(self.cache) > config['guild_config_cache_size']:
+            self.cache.popitem(last=False)
+        return settings
+
+    async def dump(self):
+        """Every guild's overrides, for backups"""
+        rows = await self._run(self._execute, 'SELECT guild_id, overrides FROM guild_config ORDER BY guild_id')
+        return {str(guild_id): json.loads(overrides) for guild_id, overrides in rows}
+
+    async def overrides(self, guild_id):
+        rows = await self._run(self._execute, 'SELECT overrides FROM guild_config WHERE guild_id = ?', (guild_id,))
+        return json.loads(rows[0][0]) if rows else {}
+
+    async def update(self, guild_id, **changes):
+        """Change a guild's overrides; a value of None restores the global setting"""
+        overrides = await self.overrides(guild_id)
+        for key, value in changes.items():
+            if value is None:
+                overrides.pop(key, None)
+            else:
+                overrides[key] = value
+
+        if overrides:
+            await self._run(self._execute, 'INSERT OR REPLACE INTO guild_config VALUES (?, ?)',
+                            (guild_id, json.dumps(overrides, separators=(',', ':'))))
+            self.overridden.add(guild_id)
+        else:
+            await self._run(self._execute, 'DELETE FROM guild_config WHERE guild_id = ?', (guild_id,))
+            self.overridden.discard(guild_id)
+        self.cache.pop(guild_id, None)
+
+guild_config = GuildConfigStore('logs/guild_config.db')
+
+def apply_config():
+    """Rebuild derived state and cached renderings after the config changes"""
+    global config_version
+    guild_config.reset()
+    config_version += 1
+
+apply_config()
+
+class ConfigWatcher:
+    """Poll config.json and apply edits made outside the bot without a restart
+
+    Settings read once at startup (sharding, the session store, queue and pool
+    sizes) still need a restart to take effect.
+    """
+
+    def __init__(self):
+        self.signature = config_file_signature()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(config['config_reload_interval'])
+            signature = config_file_signature()
+            if signature is None or signature == self.signature:
+                continue
+            self.signature = signature
+            try:
+                loaded_config = await loop.run_in_executor(config_executor, load_config)
+            except (OSError, ValueError) as e:
+                print(f"Error reloading config: {e}")
+                continue
+            config.clear()
+            config.update(loaded_config)
+            apply_config()
+            session_reaper.reschedule()
+            attachment_cache.trim()
+            broadcast_bucket.configure(config['broadcast_rate'], config['broadcast_rate'])
+            print("Reloaded config.json")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+config_watcher = ConfigWatcher()
+
+# Attachment relay
+ATTACHMENT_CHUNK_SIZE = 65536
+ATTACHMENT_CACHE_KEY = re.compile(r'[0-9a-f]{64}-[0-9]+')
+http_session = None
+
+async def get_http_session():
+    """Get the shared HTTP session used to stream attachments from the CDN"""
+    global http_session
+    if http_session is None or http_session.closed:
+        http_session = aiohttp.ClientSession()
+    return http_session
+
+async def close_http_session():
+    if http_session is not None and not http_session.closed:
+        await http_session.close()
+
+class BudgetClaim:
+    """A place in line for a share of the attachment byte budget"""
+
+    def __init__(self, budget, size):
+        self.budget = budget
+        self.size = size
+        self.granted = asyncio.get_running_loop().create_future()
+        self.released = False
+
+    async def wait(self):
+        """Wait until the claimed bytes are granted"""
+        await asyncio.shield(self.granted)
+
+    def release(self):
+        """Return the bytes, or give up the place in line if they were not granted yet"""
+        if not self.released:
+            self.released = True
+            self.budget._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+class ByteBudget:
+    """Limit the number of attachment bytes buffered at once across all relays
+
+    Bytes are granted strictly in the order they were claimed, so a claim never
+    waits behind a smaller one that arrived after it.
+    """
+
+    def __init__(self):
+        self.in_use = 0
+        self.waiting = deque()  # BudgetClaims not granted yet, in arrival order
+
+    def claim(self, size):
+        """Take the next place in line for size bytes"""
+        # A single claim larger than the whole budget waits for exclusive use of it
+        claim = BudgetClaim(self, min(size, config['attachment_inflight_budget']))
+        if claim.size:
+            self.waiting.append(claim)
+            self._grant()
+        else:
+            claim.granted.set_result(None)
+        return claim
+
+    def _grant(self):
+        while self.waiting:
+            claim = self.waiting[0]
+            # Checking in_use lets claims through one at a time if the budget was lowered below one of them
+            if self.in_use and self.in_use + claim.size > config['attachment_inflight_budget']:
+                break
+            self.waiting.popleft()
+            self.in_use += claim.size
+            claim.granted.set_result(None)
+
+    def _release(self, claim):
+        if claim.granted.done():
+            self.in_use -= claim.size
+        else:
+            self.waiting.remove(claim)
+        self._grant()
+
+attachment_budget = ByteBudget()
+download_slots = None
+
+def get_download_slots(dm_info):
+    """Get the global and per-session semaphores bounding attachment downloads"""
+    global download_slots
+    if download_slots is None:
+        download_slots = asyncio.Semaphore(config['download_concurrency'])
+    if dm_info is None:
+        return download_slots, None
+    if 'download_slots' not in dm_info:
+        dm_info['download_slots'] = asyncio.Semaphore(config['session_download_concurrency'])
+    return download_slots, dm_info['download_slots']
+
+class MappedFile(io.RawIOBase):
+    """Read-only file object over a memory-mapped file
+
+    Uploads read straight from the page cache instead of a copy in memory.
+    An attachment cache entry stays pinned against eviction until the file
+    is closed.
+    """
+
+    def __init__(self, file, cache=None, key=None):
+        self.cache = cache
+        self.key = key
+        self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if cache is not None:
+            cache.pin(key)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._map.read(size if size is not None and size >= 0 else None)
+
+    def readinto(self, buffer):
+        data = self._map.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._map.seek(offset, whence)
+        return self._map.tell()
+
+    def tell(self):
+        return self._map.tell()
+
+    def close(self):
+        if not self.closed:
+            self._map.close()
+            if self.cache is not None:
+                self.cache.unpin(self.key)
+        super().close()
+
+class AttachmentCache:
+    """Content-addressed store of downloaded attachments in files/
+
+    Entries are named {sha256}-{size}, so identical files are stored once
+    whatever attachment they came from. Discord gives no hash before the
+    download, so entries are also indexed by attachment ID: an attachment
+    relayed to several sessions is downloaded from the CDN only once. Least
+    recently used entries beyond attachment_cache_size bytes are deleted by a
+    background task; entries open for an upload are skipped until closed.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.entries = OrderedDict()  # {key: size}, least recently used first
+        self.sources = {}  # {attachment_id: key}
+        self.aliases = {}  # {key: [attachment_id, ...]}
+        self.pins = {}  # {key: open files}
+        self.total = 0
+        self._evicted = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._task = None
+        self._wake = None
+
+    @property
+    def enabled(self):
+        return bool(config['attachment_cache_size'])
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def start(self):
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def _scan(self):
+        """Find entries left by a previous run, oldest first, and drop partial downloads and evictions"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(('.part', '.evicted')):
+                os.remove(entry.path)
+            elif ATTACHMENT_CACHE_KEY.fullmatch(entry.name):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+        return sorted(entries)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        # Newest first, each moved in front of the last, so the oldest ends up evicted first
+        for _, key, size in reversed(await loop.run_in_executor(self._executor, self._scan)):
+            if key not in self.entries:
+                self.entries[key] = size
+                self.entries.move_to_end(key, last=False)
+                self.total += size
+        while True:
+            await self._evict()
+            await self._wake.wait()
+            self._wake.clear()
+
+    async def _evict(self):
+        loop = asyncio.get_running_loop()
+        limit = config['attachment_cache_size'] or 0
+        for key in list(self.entries):
+            if self.total <= limit:
+                break
+            if self.pins.get(key) or key not in self.entries:
+                continue
+            # Move the file aside before the entry is dropped, so a download of the same
+            # content that finishes during the unlink can put it back at the same path
+            self._evicted += 1
+            tombstone = f'{self.path(key)}.{self._evicted}.evicted'
+            try:
+                os.replace(self.path(key), tombstone)
+            except OSError as e:
+                print(f"Error evicting cached attachment {key}: {e}")
+                continue
+            self.total -= self.entries.pop(key)
+            for attachment_id in self.aliases.pop(key, ()):
+                self.sources.pop(attachment_id, None)
+            try:
+                await loop.run_in_executor(self._executor, os.remove, tombstone)
+            except OSError as e:
+                print(f"Error evicting cached attachment {key}: {e}")
+
+    def trim(self):
+        """Wake the eviction task, e.g. after the byte cap was lowered"""
+        if self._wake is not None:
+            self._wake.set()
+
+    def pin(self, key):
+        self.pins[key] = self.pins.get(key, 0) + 1
+
+    def unpin(self, key):
+        self.pins[key] -= 1
+        if not self.pins[key]:
+            del self.pins[key]
+
+    def open(self, key):
+        """Open a cached entry for reading, marking it recently used"""
+        self.entries.move_to_end(key)
+        with open(self.path(key), 'rb') as f:
+            return MappedFile(f, self, key)
+
+    def lookup(self, attachment):
+        """Get the key of an attachment downloaded before, if it is still cached"""
+        key = self.sources.get(attachment.id)
+        if key in self.entries:
+            attachment_cache_lookups.inc(result='hit')
+            return key
+        attachment_cache_lookups.inc(result='miss')
+        return None
+
+    def add(self, attachment, partial, key, size):
+        """Move a finished download into the cache, or drop it if the content is already there"""
+        if key in self.entries:
+            os.remove(partial)
+        else:
+            os.replace(partial, self.path(key))
+            self.entries[key] = size
+            self.total += size
+            if self.total > config['attachment_cache_size']:
+                self.trim()
+        if attachment.id not in self.sources:
+            self.sources[attachment.id] = key
+            self.aliases.setdefault(key, []).append(attachment.id)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown(wait=True)
+
+attachment_cache = AttachmentCache('files')
+
+async def download_attachment(attachment, max_file_size):
+    """Stream an attachment from the CDN, or open it from the attachment cache
+
+    Without the cache, small attachments are kept in memory and large ones in
+    a temp file.
+    """
+    if attachment_cache.enabled and attachment.size:
+        key = attachment_cache.lookup(attachment)
+        if key is not None:
+            return discord.File(fp=attachment_cache.open(key), filename=attachment.filename)
+        fd, partial = tempfile.mkstemp(dir=attachment_cache.directory, suffix='.part')
+        fp = os.fdopen(fd, 'w+b')
+    elif attachment.size <= config['attachment_spool_size']:
+        fp, partial = io.BytesIO(), None
+    else:
+        fp, partial = tempfile.TemporaryFile(dir='files'), None
+    digest = hashlib.sha256()
+    try:
+        with download_seconds.time():
+            session = await get_http_session()
+            async with session.get(attachment.url) as response:
+                response.raise_for_status()
+                received = 0
+                async for chunk in response.content.iter_chunked(ATTACHMENT_CHUNK_SIZE):
+                    received += len(chunk)
+                    if received > max_file_size:
+                        raise ValueError(f"File too large: {attachment.filename}")
+                    fp.write(chunk)
+                    if partial:
+                        digest.update(chunk)
+        download_bytes.inc(received)
+        if partial:
+            fp.close()
+            key = f"{digest.hexdigest()}-{received}"
+            attachment_cache.add(attachment, partial, key, received)
+            return discord.File(fp=attachment_cache.open(key), filename=attachment.filename)
+        fp.seek(0)
+    except BaseException:
+        fp.close()
+        if partial and os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return discord.File(fp=fp, filename=attachment.filename)
+
+class AttachmentBatch:
+    """Check and download a message's attachments for relaying
+
+    Used as an async context manager; the downloaded files and their share of
+    the in-flight byte budget are released when the block exits. Eligible
+    attachments are downloaded concurrently and kept in their original order.
+    Relays pass the claim they took with claim_budget when the message was
+    queued; a batch without one claims its budget on entry.
+    """
+
+    def __init__(self, attachments, dm_info=None, guild=None, claim=None):
+        self.attachments = attachments
+        self.dm_info = dm_info
+        self.guild = guild
+        self.claim = claim
+        self.max_file_size = None
+        self.results = []  # [(attachment, error)] with error None, 'type', 'size' or 'download'
+        self.files = []
+        self.hashes = []  # Attachment cache keys of the files, None where the cache was not used
+
+    @staticmethod
+    def claim_budget(attachments):
+        """Claim the attachments' share of the in-flight byte budget
+
+        Claimed in the same order as the relay queue, so a relay never waits
+        for budget held by one queued behind it.
+        """
+        return attachment_budget.claim(sum(min(a.size, config['attachment_spool_size']) for a in attachments))
+
+    async def __aenter__(self):
+        # The guild receiving or sending the files decides which are allowed
+        settings = await guild_config.get(self.guild)
+        self.max_file_size = settings.max_file_size
+        eligible = []  # Indexes of the attachments to download
+        for attachment in self.attachments:
+            file_ext = os.path.splitext(attachment.filename)[1].lower()
+            if file_ext not in settings.allowed_extensions:
+                self.results.append((attachment, 'type'))
+            elif attachment.size > self.max_file_size:
+                self.results.append((attachment, 'size'))
+            else:
+                eligible.append(len(self.results))
+                self.results.append((attachment, None))
+
+        if not eligible:
+            if self.claim is not None:
+                self.claim.release()
+        else:
+            # Claim the whole batch at once so relays never hold part of the budget while waiting
+            if self.claim is None:
+                self.claim = self.claim_budget(self.attachments[index] for index in eligible)
+            try:
+                await self.claim.wait()
+            except BaseException:
+                self.claim.release()
+                raise
+            results = await asyncio.gather(
+                *(self._download(self.attachments[index]) for index in eligible),
+                return_exceptions=True
+            )
+            self.files = [result for result in results if isinstance(result, discord.File)]
+            self.hashes = [getattr(file.fp, 'key', None) for file in self.files]
+            # A failed download is reported for its own file; the message and other files still go through
+            for index, result in zip(eligible, results):
+                if isinstance(result, Exception):
+                    attachment = self.results[index][0]
+                    self.results[index] = (attachment, 'download')
+                    print(f"Error downloading attachment {attachment.filename}: {result}")
+            errors = [result for result in results if isinstance(result, BaseException) and not isinstance(result, Exception)]
+            if errors:
+                await self.__aexit__(None, None, None)
+                raise errors[0]
+        return self
+
+    @property
+    def accepted(self):
+        """Filenames of the attachments that passed the type and size checks"""
+        return [attachment.filename for attachment, error in self.results if error is None]
+
+    async def _download(self, attachment):
+        global_slots, session_slots = get_download_slots(self.dm_info)
+        if session_slots is None:
+            async with global_slots:
+                return await download_attachment(attachment, self.max_file_size)
+        async with session_slots, global_slots:
+            return await download_attachment(attachment, self.max_file_size)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        close_files(self.files)
+        self.files = []
+        if self.claim is not None:
+            self.claim.release()
+
+# Outbound relay scheduling
+class TokenBucket:
+    """Allow bursts of up to burst sends, then rate sends per second"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def configure(self, rate, burst):
+        """Apply a new rate and burst, keeping the tokens already earned up to the new burst"""
+        self.rate = rate
+        self.burst = burst
+        self.tokens = min(self.tokens, burst)
+
+    async def take(self):
+        # A rate of 0 turns pacing off
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            # Claim the token now and wait for it to refill, so concurrent callers queue up behind it
+            await asyncio.sleep(-self.tokens / self.rate)
+
+class RelayJob:
+    """A queued relay send whose place in line is held from the moment the message arrives"""
+
+    def __init__(self):
+        loop = asyncio.get_running_loop()
+        self.ready = loop.create_future()  # Resolves to (destination, kwargs), or None if discarded
+        self.result = loop.create_future()
+        self.queued_at = time.monotonic()
+        self.coalesce = None
+
+    def submit(self, destination, coalesce=None, **kwargs):
+        """Hand the job its content; wait on job.result for the sent message
+
+        Embed-only jobs submitted with the same coalesce key may be merged into
+        one message during the inbound coalescing window.
+        """
+        if not self.ready.done():
+            self.coalesce = coalesce
+            self.ready.set_result((destination, kwargs))
+
+    def discard(self):
+        """Give up the job's place in line if nothing was submitted"""
+        if not self.ready.done():
+            self.ready.set_result(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.discard()
+
+class RelayScheduler:
+    """Send relayed messages through per-destination FIFO queues paced by token buckets
+
+    Each destination (admin channel or target user) is drained in order by its
+    own worker, at most relay_burst messages at once and relay_rate per second
+    after that. When a queue backs up, consecutive text-only messages are
+    combined into a single send. With inbound_coalesce_window set, embeds that
+    share a coalesce key and arrive within the window are merged into one
+    embed with a field per message.
+    """
+
+    MAX_CONTENT_LENGTH = 2000
+    MAX_EMBED_FIELDS = 25
+    MAX_EMBED_LENGTH = 6000
+    MAX_FIELD_LENGTH = 1024
+
+    def __init__(self):
+        self.queues = {}  # {destination_id: deque of RelayJob}
+        self.workers = {}  # {destination_id: task}
+        self.buckets = {}  # {destination_id: TokenBucket}
+        self.arrivals = {}  # {destination_id: future resolved when a job is next queued}
+        self.delays = deque(maxlen=1000)  # Recent seconds between queueing and sending
+        self.sent = 0
+        self.coalesced = 0
+
+    def reserve(self, destination_id):
+        """Take the next place in a destination's queue"""
+        job = RelayJob()
+        self.queues.setdefault(destination_id, deque()).append(job)
+        arrival = self.arrivals.pop(destination_id, None)
+        if arrival is not None and not arrival.done():
+            arrival.set_result(None)
+        if destination_id not in self.workers:
+            self.workers[destination_id] = asyncio.create_task(self._run(destination_id))
+        return job
+
+    async def send(self, destination, **kwargs):
+        """Queue a send to a channel or user and wait for the sent message"""
+        job = self.reserve(destination.id)
+        job.submit(destination, **kwargs)
+        return await job.result
+
+    @staticmethod
+    def _text_only(submission):
+        return submission is not None and set(submission[1]) == {'content'} and submission[1]['content']
+
+    @classmethod
+    def _embed_only(cls, job, submission):
+        """Whether a job is a coalescable embed with no files or fields of its own"""
+        if job.coalesce is None or submission is None:
+            return False
+        kwargs = submission[1]
+        embed = kwargs.get('embed')
+        return (
+            embed is not None and not kwargs.get('files') and set(kwargs) <= {'embed', 'files'}
+            and not embed.fields and len(embed.description or '') <= cls.MAX_FIELD_LENGTH
+        )
+
+    async def _next_ready(self, destination_id, queue, deadline):
+        """Wait until the job after the current one is prepared, or None once the deadline passes"""
+        while True:
+            timeout = deadline - time.monotonic()
+            if queue and queue[0].ready.done():
+                return queue[0]
+            if timeout <= 0:
+                return None
+            if queue:
+                waiter = queue[0].ready
+            else:
+                waiter = self.arrivals.setdefault(destination_id, asyncio.get_running_loop().create_future())
+            await asyncio.wait({waiter}, timeout=timeout)
+
+    async def _coalesce_embeds(self, destination_id, batch, embed, queue):
+        """Add the jobs that follow within the window to batch and build one embed for all of them"""
+        job = batch[0]
+        embeds = [embed]
+        length = len(embed) + 8
+        deadline = job.queued_at + config['inbound_coalesce_window']
+        while len(embeds) < self.MAX_EMBED_FIELDS:
+            next_job = await self._next_ready(destination_id, queue, deadline)
+            if next_job is None:
+                break
+            submission = next_job.ready.result()
+            if submission is None:
+                queue.popleft()
+                continue
+            if next_job.coalesce != job.coalesce or not self._embed_only(next_job, submission):
+                break
+            next_embed = submission[1]['embed']
+            # Each message becomes a field named by its time
+            length += len(next_embed.description or '') + 8
+            if length > self.MAX_EMBED_LENGTH:
+                break
+            embeds.append(next_embed)
+            batch.append(queue.popleft())
+        if len(embeds) == 1:
+            return embed
+
+        combined = discord.Embed(color=embed.color, timestamp=embeds[-1].timestamp)
+        combined.set_author(name=embed.author.name, icon_url=embed.author.icon_url)
+        for part in embeds:
+            combined.add_field(name=part.timestamp.strftime('%H:%M:%S'), value=part.description or "\u200b", inline=False)
+        return combined
+
+    async def _run(self, destination_id):
+        queue = self.queues[destination_id]
+        try:
+            while queue:
+                job = queue[0]
+                submission = await job.ready
+                queue.popleft()
+                if submission is None:
+                    continue
+
+                destination, kwargs = submission
+                batch = [job]
+                # Every job taken off the queue gets a result, whatever fails on the way to sending it
+                try:
+                    if self._text_only(submission):
+                        content = kwargs['content']
+                        while queue and queue[0].ready.done() and self._text_only(queue[0].ready.result()):
+                            next_content = queue[0].ready.result()[1]['content']
+                            if len(content) + 1 + len(next_content) > self.MAX_CONTENT_LENGTH:
+                                break
+                            content += '\n' + next_content
+                            batch.append(queue.popleft())
+                        kwargs = {'content': content}
+                        self.coalesced += len(batch) - 1
+                    elif config['inbound_coalesce_window'] and self._embed_only(job, submission):
+                        kwargs = {'embed': await self._coalesce_embeds(destination_id, batch, kwargs['embed'], queue)}
+                        self.coalesced += len(batch) - 1
+
+                    if destination_id not in self.buckets:
+                        self.buckets[destination_id] = TokenBucket(config['relay_rate'], config['relay_burst'])
+                    await self.buckets[destination_id].take()
+                    now = time.monotonic()
+                    self.delays.extend(now - queued.queued_at for queued in batch)
+                    files = kwargs.get('files')
+                    uploaded = sum(file_size(file) for file in files) if files else 0
+                    with relay_send_seconds.time(kind='files' if files else 'text'):
+                        message = await destination.send(**kwargs)
+                except asyncio.CancelledError:
+                    for queued in batch:
+                        queued.result.cancel()
+                    raise
+                except Exception as e:
+                    for queued in batch:
+                        queued.result.set_exception(e)
+                else:
+                    self.sent += 1
+                    upload_bytes.inc(uploaded)
+                    for queued in batch:
+                        queued.result.set_result(message)
+        finally:
+            del self.workers[destination_id]
+            self.arrivals.pop(destination_id, None)
+            if not queue:
+                del self.queues[destination_id]
+            # Forget the bucket once it would have refilled, unless the destination is busy again
+            asyncio.get_running_loop().call_later(
+                config['relay_burst'] / config['relay_rate'] if config['relay_rate'] else 0,
+                self._drop_bucket, destination_id
+            )
+
+    def _drop_bucket(self, destination_id):
+        if destination_id not in self.workers:
+            self.buckets.pop(destination_id, None)
+
+    def stats(self):
+        """Queue depth and delay figures for status reporting"""
+        return {
+            'queued': sum(len(queue) for queue in self.queues.values()),
+            'destinations': len(self.queues),
+            'sent': self.sent,
+            'coalesced': self.coalesced,
+            'avg_delay': sum(self.delays) / len(self.delays) if self.delays else 0,
+            'max_delay': max(self.delays, default=0)
+        }
+
+relay_scheduler = RelayScheduler()
+
+# Shared by every broadcast so fan-out stays under Discord's global rate limit
+broadcast_bucket = TokenBucket(config['broadcast_rate'], config['broadcast_rate'])
+
+# Message mapping between admin channel messages and DM messages
+class MessageMapSpill(SQLiteStore):
+    """On-disk index of session message mappings
+
+    Holds mappings evicted from memory, or every mapping when sessions are
+    persisted. Rows are batched and written at most FLUSH_DELAY seconds later.
+    """
+
+    FLUSH_SIZE = 64
+    FLUSH_DELAY = 1
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.pending = {}  # {(session_id, channel_message_id): dm_message_id}
+        self._flushing = {}
+        self._flush_task = None
+
+    def _setup(self, db):
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS message_map ('
+            'session_id INTEGER, channel_message_id INTEGER, dm_message_id INTEGER, '
+            'PRIMARY KEY (session_id, channel_message_id)) WITHOUT ROWID'
+        )
+        # Reverse lookups are answered from memory; drop the index earlier versions kept for them
+        db.execute('DROP INDEX IF EXISTS message_map_dm')
+
+    def _write(self, rows):
+        db = self._connect()
+        with db:
+            db.executemany(
+                'INSERT OR REPLACE INTO message_map VALUES (?, ?, ?)',
+                [(session_id, channel_id, dm_id) for (session_id, channel_id), dm_id in rows.items()]
+            )
+
+    def _query(self, sql, args):
+        row = self._connect().execute(sql, args).fetchone()
+        return row[0] if row else None
+
+    def _delete(self, session_id):
+        db = self._connect()
+        with db:
+            db.execute('DELETE FROM message_map WHERE session_id = ?', (session_id,))
+
+    def add(self, session_id, channel_message_id, dm_message_id):
+        """Queue a mapping to be written to disk"""
+        self.pending[(session_id, channel_message_id)] = dm_message_id
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        if len(self.pending) < self.FLUSH_SIZE:
+            await asyncio.sleep(self.FLUSH_DELAY)
+        await self.flush()
+
+    async def flush(self):
+        while self.pending:
+            self._flushing, self.pending = self.pending, {}
+            try:
+                await self._run(self._write, self._flushing)
+            finally:
+                self._flushing = {}
+
+    async def lookup(self, session_id, channel_message_id):
+        key = (session_id, channel_message_id)
+        if key in self.pending or key in self._flushing:
+            return self.pending.get(key, self._flushing.get(key))
+        return await self._run(
+            self._query,
+            'SELECT dm_message_id FROM message_map WHERE session_id = ? AND channel_message_id = ?',
+            key
+        )
+
+    async def discard_session(self, session_id):
+        """Forget every spilled mapping of a finished session"""
+        for key in [key for key in self.pending if key[0] == session_id]:
+            del self.pending[key]
+        if os.path.exists(self.path):
+            await self._run(self._delete, session_id)
+
+    async def close(self):
+        await self.flush()
+        await super().close()
+
+message_map_spill = MessageMapSpill('logs/message_map.db')
+
+class MessageMap:
+    """Bounded two-way map between admin channel message IDs and DM message IDs
+
+    The most recently used mappings are kept in memory up to message_map_size;
+    older ones are dropped, or spilled to disk when message_map_spill is on.
+    When a session store is enabled, every mapping is also written through to
+    it, so a restarted bot or another bot process can still resolve it.
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.capacity = config['message_map_size']
+        self.persist = session_store.enabled
+        self.spill = config['message_map_spill'] and not self.persist
+        self.forward = OrderedDict()  # {channel_message_id: dm_message_id}
+        self.reverse = {}  # {dm_message_id: channel_message_id}
+        self.combined = {}  # {channel_message_id: [dm_message_id, ...]} for DMs relayed as one message
+
+    def __len__(self):
+        return len(self.forward)
+
+    def __contains__(self, channel_message_id):
+        return channel_message_id in self.forward
+
+    def __setitem__(self, channel_message_id, dm_message_id):
+        previous = self.forward.get(channel_message_id)
+        if previous is not None and previous != dm_message_id:
+            # Coalesced DMs all map back to the combined message; reactions on it mirror to the latest
+            self.combined.setdefault(channel_message_id, [previous]).append(dm_message_id)
+        self.forward[channel_message_id] = dm_message_id
+        self.forward.move_to_end(channel_message_id)
+        self.reverse[dm_message_id] = channel_message_id
+        if self.persist:
+            session_store.add_mapping(self.session_id, channel_message_id, dm_message_id)
+        while len(self.forward) > self.capacity:
+            old_channel_id, old_dm_id = self.forward.popitem(last=False)
+            for dm_id in self.combined.pop(old_channel_id, [old_dm_id]):
+                if self.reverse.get(dm_id) == old_channel_id:
+                    del self.reverse[dm_id]
+            if self.spill:
+                message_map_spill.add(self.session_id, old_channel_id, old_dm_id)
+
+    async def lookup(self, channel_message_id):
+        """Get the DM message mapped to an admin channel message"""
+        dm_message_id = self.forward.get(channel_message_id)
+        if dm_message_id is not None:
+            self.forward.move_to_end(channel_message_id)
+            return dm_message_id
+        if self.persist:
+            return await session_store.lookup_mapping(self.session_id, channel_message_id)
+        if self.spill:
+            return await message_map_spill.lookup(self.session_id, channel_message_id)
+        return None
+
+    def reverse_lookup(self, dm_message_id):
+        """Get the admin channel message mapped to a DM message, while it is held in memory"""
+        return self.reverse.get(dm_message_id)
+
+    async def discard(self):
+        """Forget the mappings kept outside memory once the session ends"""
+        if self.persist:
+            await session_store.discard_mappings(self.session_id)
+        elif self.spill:
+            await message_map_spill.discard_session(self.session_id)
+
+# Session stores
+class SessionStoreError(Exception):
+    """Raised when the shared session store replies with an error"""
+
+class SessionStore(ABC):
+    """Where sessions and their message mappings are kept outside a single process
+
+    Stores hold only IDs. A shared store also announces session changes so
+    every bot process keeps the same set of active sessions.
+    """
+
+    shared = False
+
+    @property
+    def enabled(self):
+        return True
+
+    @abstractmethod
+    async def load(self):
+        """Get every saved session as (author_id, target_id, channel_id, guild_id, started_at) rows"""
+
+    @abstractmethod
+    async def save(self, author_id, target_id, channel_id, guild_id, started_at):
+        """Save a started session; started_at is a Unix timestamp in whole seconds"""
+
+    @abstractmethod
+    async def delete(self, author_id):
+        """Forget a stopped session"""
+
+    @abstractmethod
+    def add_mapping(self, session_id, channel_message_id, dm_message_id):
+        """Queue a message mapping to be saved"""
+
+    @abstractmethod
+    async def lookup_mapping(self, session_id, channel_message_id):
+        """Get the DM message mapped to an admin channel message"""
+
+    @abstractmethod
+    async def discard_mappings(self, session_id):
+        """Forget every mapping of a finished session"""
+
+    def touch(self, author_id):
+        """Tell other bot processes a session was just used"""
+
+    async def listen(self, callback):
+        """Call callback(event, author_id, ...) for sessions changed or used by other bot processes"""
+
+    async def close(self):
+        pass
+
+class LocalSessionStore(SQLiteStore, SessionStore):
+    """Session store for a single bot process, persisted to SQLite"""
+
+    @property
+    def enabled(self):
+        return config['persist_sessions']
+
+    def _setup(self, db):
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS sessions ('
+            'author_id INTEGER PRIMARY KEY, target_id INTEGER, channel_id INTEGER, guild_id INTEGER, started_at INTEGER)'
+        )
+        # Sessions saved before guilds or start times were recorded keep NULLs
+        columns = {row[1] for row in db.execute('PRAGMA table_info(sessions)')}
+        if 'guild_id' not in columns:
+            db.execute('ALTER TABLE sessions ADD COLUMN guild_id INTEGER')
+        if 'started_at' not in columns:
+            db.execute('ALTER TABLE sessions ADD COLUMN started_at INTEGER')
+
+    async def load(self):
+        return await self._run(self._execute, 'SELECT author_id, target_id, channel_id, guild_id, started_at FROM sessions')
+
+    async def save(self, author_id, target_id, channel_id, guild_id, started_at):
+        await self._run(self._execute,
+                        'INSERT OR REPLACE INTO sessions (author_id, target_id, channel_id, guild_id, started_at) VALUES (?, ?, ?, ?, ?)',
+                        (author_id, target_id, channel_id, guild_id, started_at))
+
+    async def delete(self, author_id):
+        await self._run(self._execute, 'DELETE FROM sessions WHERE author_id = ?', (author_id,))
+
+    # Message mappings share the on-disk message map index
+    def add_mapping(self, session_id, channel_message_id, dm_message_id):
+        message_map_spill.add(session_id, channel_message_id, dm_message_id)
+
+    async def lookup_mapping(self, session_id, channel_message_id):
+        return await message_map_spill.lookup(session_id, channel_message_id)
+
+    async def discard_mappings(self, session_id):
+        await message_map_spill.discard_session(session_id)
+
+class RedisConnection:
+    """Minimal Redis protocol client used by the shared session store"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+        self._lock = None
+
+    @staticmethod
+    def _encode(command):
+        parts = [b'*%d\r\n' % len(command)]
+        for arg in command:
+            arg = str(arg).encode()
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+
+    async def read_reply(self):
+        """Read one reply; error replies are returned as SessionStoreError instances"""
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError("Session store connection closed")
+        kind, body = line[:1], line[1:-2]
+        if kind == b'+':
+            return body.decode()
+        if kind == b'-':
+            return SessionStoreError(body.decode())
+        if kind == b':':
+            return int(body)
+        if kind == b'$':
+            if int(body) < 0:
+                return None
+            return (await self.reader.readexactly(int(body) + 2))[:-2].decode()
+        if kind == b'*':
+            if int(body) < 0:
+                return None
+            return [await self.read_reply() for _ in range(int(body))]
+        raise SessionStoreError(f"Unexpected reply from session store: {line!r}")
+
+    async def execute(self, *commands):
+        """Send commands as one pipeline and return their replies"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                self.writer.write(b''.join(self._encode(command) for command in commands))
+                await self.writer.drain()
+                replies = [await self.read_reply() for _ in commands]
+            except BaseException:
+                # Replies left unread would be taken as the answers to later commands
+                self.close()
+                raise
+        for reply in replies:
+            if isinstance(reply, SessionStoreError):
+                raise reply
+        return replies
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+class RedisSessionStore(SessionStore):
+    """Session store shared by every bot process through a Redis server
+
+    Sessions live in the dm:sessions hash and each session's mappings in
+    dm:map:{author_id}. Starts and stops are published
+    on dm:events so other processes update their local view.
+    """
+
+    shared = True
+    FLUSH_DELAY = 0.05
+    EVENTS_CHANNEL = 'dm:events'
+
+    def __init__(self, url):
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.connection = RedisConnection(self.host, self.port)
+        self.instance_id = f'{os.getpid()}-{random.getrandbits(32):08x}'
+        self.pending = {}  # {(session_id, channel_message_id): dm_message_id}
+        self.touched = set()  # {author_id} used since the last flush
+        self._flush_task = None
+        self._listen_task = None
+
+    async def load(self):
+        sessions, = await self.connection.execute(('HGETALL', 'dm:sessions'))
+        rows = []
+        for author_id, value in zip(sessions[::2], sessions[1::2]):
+            # Sessions saved before guilds or start times were recorded have no part for them
+            target_id, channel_id, guild_id, started_at = (value.split(':') + ['', ''])[:4]
+            rows.append((
+                int(author_id), int(target_id), int(channel_id),
+                int(guild_id) if guild_id else None, int(started_at) if started_at else None
+            ))
+        return rows
+
+    async def save(self, author_id, target_id, channel_id, guild_id, started_at):
+        await self.connection.execute(
+            ('HSET', 'dm:sessions', author_id, f'{target_id}:{channel_id}:{guild_id or ""}:{started_at}'),
+            ('PUBLISH', self.EVENTS_CHANNEL,
+             f'{self.instance_id} start {author_id} {target_id} {channel_id} {guild_id or 0} {started_at}')
+        )
+
+    async def delete(self, author_id):
+        await self.connection.execute(
+            ('HDEL', 'dm:sessions', author_id),
+            ('PUBLISH', self.EVENTS_CHANNEL, f'{self.instance_id} stop {author_id}')
+        )
+
+    def add_mapping(self, session_id, channel_message_id, dm_message_id):
+        self.pending[(session_id, channel_message_id)] = dm_message_id
+        self._schedule_flush()
+
+    def touch(self, author_id):
+        self.touched.add(author_id)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        await asyncio.sleep(self.FLUSH_DELAY)
+        await self.flush()
+
+    async def flush(self):
+        while self.pending or self.touched:
+            rows, self.pending = self.pending, {}
+            touched, self.touched = self.touched, set()
+            commands = []
+            for (session_id, channel_message_id), dm_message_id in rows.items():
+                commands.append(('HSET', f'dm:map:{session_id}', channel_message_id, dm_message_id))
+            for author_id in touched:
+                commands.append(('PUBLISH', self.EVENTS_CHANNEL, f'{self.instance_id} touch {author_id}'))
+            try:
+                await self.connection.execute(*commands)
+            except (OSError, asyncio.IncompleteReadError, SessionStoreError) as e:
+                print(f"Error saving message mappings: {e}")
+
+    async def lookup_mapping(self, session_id, channel_message_id):
+        dm_message_id = self.pending.get((session_id, channel_message_id))
+        if dm_message_id is not None:
+            return dm_message_id
+        value, = await self.connection.execute(('HGET', f'dm:map:{session_id}', channel_message_id))
+        return int(value) if value is not None else None
+
+    async def discard_mappings(self, session_id):
+        for key in [key for key in self.pending if key[0] == session_id]:
+            del self.pending[key]
+        # dm:rmap is no longer written; deleting it clears reverse maps left by earlier versions
+        await self.connection.execute(('DEL', f'dm:map:{session_id}', f'dm:rmap:{session_id}'))
+
+    async def listen(self, callback):
+        if self._listen_task is None:
+            self._listen_task = asyncio.create_task(self._listen(callback))
+
+    async def _listen(self, callback):
+        while True:
+            subscriber = RedisConnection(self.host, self.port)
+            try:
+                await subscriber.execute(('SUBSCRIBE', self.EVENTS_CHANNEL))
+                while True:
+                    reply = await subscriber.read_reply()
+                    if not isinstance(reply, list) or reply[0] != 'message':
+                        continue
+                    # A bad event is skipped so the subscription keeps syncing sessions
+                    try:
+                        instance_id, event, *ids = reply[2].split()
+                        if instance_id != self.instance_id:
+                            await callback(event, *map(int, ids))
+                    except Exception as e:
+                        print(f"Error applying session event {reply[2]!r}: {e}")
+            except (OSError, asyncio.IncompleteReadError, SessionStoreError) as e:
+                print(f"Lost session store subscription, retrying: {e}")
+                await asyncio.sleep(5)
+            finally:
+                subscriber.close()
+
+    async def close(self):
+        await self.flush()
+        if self._listen_task is not None:
+            self._listen_task.cancel()
+            self._listen_task = None
+        self.connection.close()
+
+def create_session_store():
+    """Create the session store selected by the session_store setting"""
+    if config['session_store'].startswith('redis://'):
+        return RedisSessionStore(config['session_store'])
+    return LocalSessionStore('logs/sessions.db')
+
+session_store = create_session_store()
+
+def restored_session(author_id, target_id, channel_id, guild_id=None, started_at=None):
+    """Build a session from IDs; its user and channel are resolved on first use"""
+    dm_info = {
+        'user': discord.Object(id=target_id),
+        'channel': None,
+        'channel_id': channel_id,
+        'guild_id': guild_id or None,
+        'dm_channel': None,
+        'message_map': MessageMap(author_id)
+    }
+    # Sessions saved without a start time count from when they were restored
+    if started_at:
+        dm_info['started_at'] = started_at
+    return dm_info
+
+async def restore_sessions():
+    """Rebuild saved sessions from their IDs without any API calls"""
+    if not session_store.enabled:
+        return
+    for author_id, target_id, channel_id, guild_id, started_at in await session_store.load():
+        await start_dm(author_id, restored_session(author_id, target_id, channel_id, guild_id, started_at), persist=False)
+
+async def apply_session_event(event, author_id, target_id=None, channel_id=None, guild_id=None, started_at=None):
+    """Mirror a session started, stopped or used by another bot process"""
+    if event == 'touch':
+        # Keeps the session from looking idle to the process that expires sessions
+        if author_id in active_dms:
+            active_dms[author_id]['last_active'] = time.monotonic()
+        return
+    await stop_dm(author_id, persist=False)
+    if event == 'start':
+        await start_dm(author_id, restored_session(author_id, target_id, channel_id, guild_id, started_at), persist=False)
+
+async def resolve_session(dm_info):
+    """Resolve a restored session's user and channel, preferring the gateway cache
+
+    The admin channel may live on a shard owned by another process, so a
+    partial channel is used when it is not cached; sending only needs its ID.
+    """
+    if dm_info['channel'] is None:
+        channel_id = dm_info['channel_id']
+        dm_info['channel'] = bot.get_channel(channel_id) or bot.get_partial_messageable(channel_id, guild_id=dm_info['guild_id'])
+    if isinstance(dm_info['user'], discord.Object):
+        user_id = dm_info['user'].id
+        dm_info['user'] = await resolve_user(user_id)
+
+# Transcript logging
+class TranscriptWriter:
+    """Append DM transcripts to daily JSON Lines files from a background task
+
+    Entries are queued by the relay handlers and written in batches on a worker
+    thread, so disk I/O never runs on the event loop. Files follow the
+    logs/dm_{author_id}_{YYYYMMDD}.json scheme used by export.
+    """
+
+    def __init__(self):
+        self.queue = None
+        self.files = {}  # {path: open file}
+        self._task = None
+        self._last_fsync = time.monotonic()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def start(self):
+        if self._task is None:
+            self.queue = asyncio.Queue(maxsize=config['transcript_queue_size'])
+            self._task = asyncio.create_task(self._run())
+
+    async def log(self, author_id, entry):
+        """Queue a transcript entry, waiting only if the queue is full"""
+        if not config['default_logging'] or self._task is None:
+            return
+        await self.queue.put((author_id, entry))
+
+    async def join(self):
+        """Wait until every queued entry has been written"""
+        if self._task is not None:
+            await self.queue.join()
+
+    async def release(self, author_id):
+        """Write an author's queued entries, then sync and close their transcript files"""
+        if self._task is not None:
+            await self.queue.join()
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._close_author, author_id)
+
+    async def open_index(self):
+        """Open the transcript index on the writer's thread, importing existing daily logs the first time"""
+        await asyncio.get_running_loop().run_in_executor(self._executor, transcript_index._connect)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                item = await asyncio.wait_for(self.queue.get(), timeout=config['transcript_fsync_interval'])
+            except asyncio.TimeoutError:
+                await loop.run_in_executor(self._executor, self._sync)
+                continue
+            if item is None:
+                self.queue.task_done()
+                break
+
+            batch = [item]
+            while len(batch) < config['transcript_batch_size'] and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            stop = batch[-1] is None
+            entries = [entry for entry in batch if entry is not None]
+            try:
+                await loop.run_in_executor(self._executor, self._write, entries)
+            except OSError as e:
+                print(f"Error writing transcript: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if stop:
+                break
+
+        await loop.run_in_executor(self._executor, self._close_files)
+
+    def _write(self, entries):
+        try:
+            transcript_index.add(entries)
+        except sqlite3.Error as e:
+            print(f"Error indexing transcript: {e}")
+
+        date = datetime.now().strftime("%Y%m%d")
+        # Rotate: close files from previous days
+        for path in [path for path in self.files if not path.endswith(f'_{date}.json')]:
+            self.files.pop(path).close()
+
+        for author_id, entry in entries:
+            path = f'logs/dm_{author_id}_{date}.json'
+            if path not in self.files:
+                self.files[path] = open(path, 'a', encoding='utf-8')
+            self.files[path].write(json.dumps(entry, ensure_ascii=False) + '\n')
+        for file in self.files.values():
+            file.flush()
+
+        if time.monotonic() - self._last_fsync >= config['transcript_fsync_interval']:
+            self._sync()
+
+    def _sync(self):
+        for file in self.files.values():
+            os.fsync(file.fileno())
+        self._last_fsync = time.monotonic()
+
+    def _close_author(self, author_id):
+        prefix = f'logs/dm_{author_id}_'
+        for path in [path for path in self.files if path.startswith(prefix)]:
+            file = self.files.pop(path)
+            os.fsync(file.fileno())
+            file.close()
+
+    def _close_files(self):
+        self._sync()
+        for file in self.files.values():
+            file.close()
+        self.files = {}
+        transcript_index.close()
+
+    async def close(self):
+        """Write every queued entry and close the transcript files"""
+        if self._task is not None:
+            await self.queue.put(None)
+            await self._task
+            self._task = None
+
+transcript_writer = TranscriptWriter()
+
+TRANSCRIPT_COLUMNS = ('timestamp', 'direction', 'author_id', 'target_id', 'sender_id',
+                      'message_id', 'relayed_message_id', 'content', 'attachments', 'attachment_hashes', 'guild_id')
+TRANSCRIPT_JSON_COLUMNS = ('attachments', 'attachment_hashes')
+TRANSCRIPT_EXPORT_PAGE_SIZE = 1000
+
+class TranscriptIndex:
+    """SQLite index of transcript entries with full-text search over message content
+
+    Written from the transcript writer's thread as entries are logged. When the
+    index is first created, existing daily log files are imported into it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+
+    def _connect(self):
+        if self._db is None:
+            exists = os.path.exists(self.path)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            with self._db:
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, '
+                    + ', '.join(TRANSCRIPT_COLUMNS) + ')'
+                )
+                # Indexes created before a column was added get it as NULL in existing rows
+                existing = {row[1] for row in self._db.execute('PRAGMA table_info(messages)')}
+                for column in TRANSCRIPT_COLUMNS:
+                    if column not in existing:
+                        self._db.execute(f'ALTER TABLE messages ADD COLUMN {column}')
+                self._db.execute('CREATE INDEX IF NOT EXISTS messages_target ON messages (target_id, timestamp)')
+                self._db.execute('CREATE INDEX IF NOT EXISTS messages_timestamp ON messages (timestamp)')
+                self._db.execute('CREATE INDEX IF NOT EXISTS messages_guild ON messages (guild_id, target_id, timestamp)')
+                self._db.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts "
+                    "USING fts5(content, content='messages', content_rowid='id')"
+                )
+            if not exists:
+                self._import_logs()
+        return self._db
+
+    def _import_logs(self):
+        for entry in sorted(os.scandir('logs'), key=lambda entry: entry.name):
+            if not (entry.name.startswith('dm_') and entry.name.endswith('.json')):
+                continue
+            author_id = int(entry.name.split('_')[1])
+            with open(entry.path, 'r', encoding='utf-8') as f:
+                self.add([(author_id, json.loads(line)) for line in f if line.strip()])
+
+    def add(self, entries):
+        db = self._connect()
+        with db:
+            for _, entry in entries:
+                row = [
+                    json.dumps(entry.get(column) or []) if column in TRANSCRIPT_JSON_COLUMNS else entry.get(column)
+                    for column in TRANSCRIPT_COLUMNS
+                ]
+                cursor = db.execute(
+                    f'INSERT INTO messages ({", ".join(TRANSCRIPT_COLUMNS)}) '
+                    f'VALUES ({", ".join("?" * len(TRANSCRIPT_COLUMNS))})',
+                    row
+                )
+                db.execute('INSERT INTO messages_fts (rowid, content) VALUES (?, ?)',
+                           (cursor.lastrowid, entry.get('content') or ''))
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+transcript_index = TranscriptIndex('logs/transcripts.db')
+
+def export_transcripts(directory, name, guild_id, author_id, part_size, target_id=None, start=None, end=None, keyword=None):
+    """Write matching transcript entries to JSON Lines files (runs in a worker thread)
+
+    Only sessions run from guild_id are exported, plus the caller's own
+    entries logged before sessions recorded their guild. Rows are read from
+    the index in pages and a new part file is started whenever the current
+    one would exceed part_size bytes. Returns the paths of the written files.
+    """
+    conditions = ['(m.guild_id = ? OR (m.guild_id IS NULL AND m.author_id = ?))']
+    args = [guild_id, author_id]
+    source = 'messages m'
+    if keyword:
+        source = 'messages_fts JOIN messages m ON m.id = messages_fts.rowid'
+        conditions.append('messages_fts MATCH ?')
+        args.append('"' + keyword.replace('"', '""') + '"')
+    if target_id is not None:
+        conditions.append('m.target_id = ?')
+        args.append(target_id)
+    if start:
+        conditions.append('m.timestamp >= ?')
+        args.append(start)
+    if end:
+        conditions.append('m.timestamp < ?')
+        args.append(end)
+    conditions.append('m.id > ?')
+    query = (f'SELECT m.id, {", ".join("m." + column for column in TRANSCRIPT_COLUMNS)} FROM {source} '
+             f'WHERE {" AND ".join(conditions)} ORDER BY m.id LIMIT {TRANSCRIPT_EXPORT_PAGE_SIZE}')
 
-# Store active DM channels and their configurations
-active_dms = {}  # {author_id: {'user': target_user, 'channel': channel, 'message_map': {}}}
+    paths, out, size, last_id = [], None, 0, 0
+    db = sqlite3.connect(f'file:{transcript_index.path}?mode=ro', uri=True)
+    try:
+        while True:
+            rows = db.execute(query, args + [last_id]).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                entry = dict(zip(TRANSCRIPT_COLUMNS, row[1:]))
+                for column in TRANSCRIPT_JSON_COLUMNS:
+                    entry[column] = json.loads(entry[column] or '[]')
+                line = (json.dumps(entry, ensure_ascii=False) + '\n').encode('utf-8')
+                if out is None or size + len(line) > part_size:
+                    if out is not None:
+                        out.close()
+                    paths.append(os.path.join(directory, f'{name}_part{len(paths) + 1}.json'))
+                    out, size = open(paths[-1], 'wb'), 0
+                out.write(line)
+                size += len(line)
+            last_id = rows[-1][0]
+    finally:
+        db.close()
+        if out is not None:
+            out.close()
+    return paths
 
-# Ensure directories exist
-os.makedirs('logs', exist_ok=True)
-os.makedirs('files', exist_ok=True)
+async def send_transcript_export(ctx, name, **filters):
+    """Export matching transcripts and upload them, split into parts if needed"""
+    await transcript_writer.join()
+    await transcript_writer.open_index()
+    with tempfile.TemporaryDirectory(dir='files') as directory:
+        paths = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: export_transcripts(
+                directory, name, ctx.guild.id, ctx.author.id, ctx.guild.filesize_limit, **filters
+            )
+        )
+        if not paths:
+            await ctx.send("No matching logs found.")
+            return
+        for index, path in enumerate(paths, start=1):
+            label = f" (part {index}/{len(paths)})" if len(paths) > 1 else ""
+            await ctx.send(f"Here are the matching chat logs{label}:", file=discord.File(path))
 
-# Default configuration
-DEFAULT_CONFIG = {
-    'prefix': '!',
-    'default_logging': True,
-    'max_file_size': 8388608,  # 8MB
-    'allowed_file_types': ['.txt', '.png', '.jpg', '.jpeg', '.gif', '.mp4', '.pdf', '.zip', '.docx', '.xlsx']  # Extended file types
-}
+def parse_date_range(start, end):
+    """Convert YYYY-MM-DD bounds into timestamp bounds, with the end date inclusive"""
+    start_bound = datetime.strptime(start, "%Y-%m-%d").strftime("%Y-%m-%d") if start else None
+    end_bound = (datetime.strptime(end, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d") if end else None
+    return start_bound, end_bound
 
-# Helper functions
-def format_duration(seconds):
-    """Format seconds into human readable time"""
-    minutes, seconds = divmod(seconds, 60)
-    hours, minutes = divmod(minutes, 60)
-    days, hours = divmod(hours, 24)
-    
-    parts = []
-    if days > 0:
-        parts.append(f"{int(days)}d")
-    if hours > 0:
-        parts.append(f"{int(hours)}h")
-    if minutes > 0:
-        parts.append(f"{int(minutes)}m")
-    if seconds > 0 or not parts:
-        parts.append(f"{int(seconds)}s")
-    
-    return " ".join(parts)
+async def log_transcript(author_id, guild_id, direction, source_message, relayed_message, target_id, filenames, hashes=None):
+    """Record a relayed message in the session's transcript
 
-def get_system_info():
-    """Get system information"""
+    Attachments are referenced by their attachment cache key rather than stored
+    again; the file is in files/ for as long as the cache keeps it.
+    """
+    await transcript_writer.log(author_id, {
+        'timestamp': source_message.created_at.isoformat(),
+        'direction': direction,
+        'author_id': author_id,
+        'target_id': target_id,
+        'sender_id': source_message.author.id,
+        'message_id': source_message.id,
+        'relayed_message_id': relayed_message.id if relayed_message else None,
+        'content': source_message.content,
+        'attachments': filenames,
+        'attachment_hashes': hashes or [None] * len(filenames),
+        'guild_id': guild_id
+    })
+
+# Metrics
+SPARKLINE_BLOCKS = "▁▂▃▄▅▆▇█"
+SPARKLINE_LENGTH = 20
+
+def sparkline(values):
+    """Render values as a row of block characters scaled between their min and max"""
+    if not values:
+        return ""
+    low, high = min(values), max(values)
+    scale = (len(SPARKLINE_BLOCKS) - 1) / (high - low) if high > low else 0
+    return "".join(SPARKLINE_BLOCKS[int((value - low) * scale)] for value in values)
+
+def read_system_metrics(process):
+    """Read CPU and memory figures from psutil (runs in a worker thread)"""
     return {
-        'os': platform.system(),
-        'python_version': platform.python_version(),
-        'discord_version': discord.__version__,
-        'cpu_usage': psutil.cpu_percent(),
-        'memory_usage': psutil.virtual_memory().percent,
-        'uptime': time.time() - psutil.boot_time()
+        'cpu': psutil.cpu_percent(interval=None),
+        'memory': psutil.virtual_memory().percent,
+        'rss': process.memory_info().rss
     }
 
-# Load configuration
-def load_config():
-    try:
-        with open('config.json', 'r') as f:
-            loaded_config = json.load(f)
-            # Update with any missing default values
-            for key, value in DEFAULT_CONFIG.items():
-                if key not in loaded_config:
-                    loaded_config[key] = value
-    except FileNotFoundError:
-        loaded_config = DEFAULT_CONFIG.copy()
-        # Save the default config
-        with open('config.json', 'w') as f:
-            json.dump(loaded_config, f, indent=4)
-    return loaded_config
+class MetricsSampler:
+    """Sample system and relay metrics on a fixed interval into a ring buffer
 
-# Save configuration
-def save_config():
-    with open('config.json', 'w') as f:
-        json.dump(config, f, indent=4)
+    Every sample also refreshes a precomputed snapshot with the latest value,
+    a rolling average over metrics_window samples and a sparkline per metric,
+    so the status command only reads it.
+    """
 
-config = load_config()
+    METRICS = ('cpu', 'memory', 'rss', 'loop_lag', 'sessions', 'relay_rate')
 
-# Update bot's command prefix
-def update_command_prefix():
-    bot.command_prefix = config['prefix']
+    def __init__(self):
+        self.samples = deque(maxlen=config['metrics_history'])
+        self.snapshot = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        process = psutil.Process()
+        # The first cpu_percent call only sets the baseline for the next one
+        await loop.run_in_executor(None, read_system_metrics, process)
+        last_sent, last_time = relay_scheduler.sent, loop.time()
+        while True:
+            expected = loop.time() + config['metrics_interval']
+            await asyncio.sleep(config['metrics_interval'])
+            now = loop.time()
+            sample = await loop.run_in_executor(None, read_system_metrics, process)
+            sample['loop_lag'] = max(0.0, now - expected)
+            sample['sessions'] = len(active_dms)
+            sample['relay_rate'] = (relay_scheduler.sent - last_sent) / (now - last_time)
+            last_sent, last_time = relay_scheduler.sent, now
+            self.samples.append(sample)
+            self.snapshot = self._summarize()
+
+    def _summarize(self):
+        window = list(self.samples)[-config['metrics_window']:]
+        recent = list(self.samples)[-SPARKLINE_LENGTH:]
+        return {
+            metric: {
+                'latest': window[-1][metric],
+                'average': sum(sample[metric] for sample in window) / len(window),
+                'sparkline': sparkline([sample[metric] for sample in recent])
+            }
+            for metric in self.METRICS
+        }
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+metrics_sampler = MetricsSampler()
 
 @bot.event
 async def on_ready():
@@ -119,139 +2223,216 @@ async def on_message(message):
 
     # For DM responses from target user
     if isinstance(message.channel, discord.DMChannel):
-        await handle_dm_response(message)
+        with dispatch_seconds.time(route='dm'):
+            await handle_dm_response(message)
     
     # For messages from admin initiator
-    elif message.author.id in active_dms and not message.content.startswith(config['prefix']):
-        # Check if the author is still an admin
-        guild = bot.get_guild(message.guild.id)
-        member = await guild.fetch_member(message.author.id)
-        if member and member.guild_permissions.administrator:
-            await handle_initiator_message(message)
-        else:
-            # Remove the session if the user is no longer an admin
-            await stop_dm(message.author.id)
-            await message.channel.send("Your DM session has been terminated as you are no longer an administrator.")
+    elif message.author.id in active_dms and not message.content.startswith((await guild_config.get(message.guild)).prefix):
+        with dispatch_seconds.time(route='initiator'):
+            # Check if the author is still an admin
+            if await check_admin(message.guild, message.author):
+                await handle_initiator_message(message)
+            else:
+                # Remove the session if the user is no longer an admin
+                await stop_dm(message.author.id)
+                await message.channel.send("Your DM session has been terminated as you are no longer an administrator.")
     
     await bot.process_commands(message)
 
 @bot.event
-async def on_reaction_add(reaction, user):
+async def on_member_update(before, after):
+    """Refresh admin status when a member's roles change"""
+    invalidate_admin(after.guild.id, after.id)
+    member_cache.pop((after.guild.id, after.id), None)
+
+@bot.event
+async def on_raw_member_remove(payload):
+    """Forget admin status for members leaving a guild, cached or not"""
+    invalidate_admin(payload.guild_id, payload.user.id)
+    member_cache.pop((payload.guild_id, payload.user.id), None)
+
+@bot.event
+async def on_guild_role_update(before, after):
+    """Refresh admin status for the whole guild when a role's permissions change"""
+    if before.permissions != after.permissions:
+        invalidate_admin(after.guild.id)
+
+@bot.event
+async def on_guild_role_delete(role):
+    """Refresh admin status for the whole guild when a role is deleted"""
+    invalidate_admin(role.guild.id)
+
+@bot.event
+async def on_raw_reaction_add(payload):
     """Handle reaction adding"""
-    if user == bot.user:
+    if payload.user_id == bot.user.id:
         return
         
-    # Check if reaction is from the initiator
-    if user.id in active_dms:
-        dm_info = active_dms[user.id]
+    # Check if reaction is from the initiator of a one-to-one session
+    if payload.user_id in active_dms and 'recipients' not in active_dms[payload.user_id]:
+        dm_info = active_dms[payload.user_id]
         # Get the corresponding message in the DM
-        if reaction.message.id in dm_info.get('message_map', {}):
-            target_message_id = dm_info['message_map'][reaction.message.id]
+        target_message_id = await dm_info['message_map'].lookup(payload.message_id)
+        if target_message_id is not None:
             try:
-                # Get the message from DM channel
-                channel = await dm_info['user'].create_dm()
-                message = await channel.fetch_message(target_message_id)
-                # Add the same reaction
-                await message.add_reaction(reaction.emoji)
+                with reaction_seconds.time(action='add'):
+                    message = await get_dm_message(dm_info, target_message_id)
+                    # Add the same reaction
+                    await message.add_reaction(payload.emoji)
             except (discord.NotFound, discord.Forbidden, discord.HTTPException) as e:
+                reaction_errors.inc(action='add')
                 print(f"Error mirroring reaction: {e}")
 
 @bot.event
-async def on_reaction_remove(reaction, user):
+async def on_raw_reaction_remove(payload):
     """Handle reaction removal"""
-    if user == bot.user:
+    if payload.user_id == bot.user.id:
         return
         
-    # Check if reaction is from the initiator
-    if user.id in active_dms:
-        dm_info = active_dms[user.id]
+    # Check if reaction is from the initiator of a one-to-one session
+    if payload.user_id in active_dms and 'recipients' not in active_dms[payload.user_id]:
+        dm_info = active_dms[payload.user_id]
         # Get the corresponding message in the DM
-        if reaction.message.id in dm_info.get('message_map', {}):
-            target_message_id = dm_info['message_map'][reaction.message.id]
+        target_message_id = await dm_info['message_map'].lookup(payload.message_id)
+        if target_message_id is not None:
             try:
-                # Get the message from DM channel
-                channel = await dm_info['user'].create_dm()
-                message = await channel.fetch_message(target_message_id)
-                # Remove the same reaction
-                await message.remove_reaction(reaction.emoji, bot.user)
+                with reaction_seconds.time(action='remove'):
+                    message = await get_dm_message(dm_info, target_message_id)
+                    # Remove the same reaction
+                    await message.remove_reaction(payload.emoji, bot.user)
             except (discord.NotFound, discord.Forbidden, discord.HTTPException) as e:
+                reaction_errors.inc(action='remove')
                 print(f"Error removing reaction: {e}")
 
+async def get_dm_message(dm_info, message_id):
+    """Get a partial handle to a message in the session's DM channel without fetching it"""
+    partial_messages = dm_info.setdefault('partial_messages', OrderedDict())
+    message = partial_messages.get(message_id)
+    if message is not None:
+        partial_messages.move_to_end(message_id)
+        return message
+
+    if dm_info.get('dm_channel') is None:
+        await resolve_session(dm_info)
+        dm_info['dm_channel'] = await dm_info['user'].create_dm()
+    message = dm_info['dm_channel'].get_partial_message(message_id)
+    partial_messages[message_id] = message
+    if len(partial_messages) > PARTIAL_MESSAGE_CACHE_SIZE:
+        partial_messages.popitem(last=False)
+    return message
+
 async def handle_dm_response(message):
     """Handle incoming DMs from target users"""
-    for author_id, dm_info in active_dms.items():
-        if dm_info['user'].id == message.author.id:
-            channel = dm_info['channel']
-            
-            embed = discord.Embed(
-                description=message.content if message.content else "Sent an attachment",
-                color=discord.Color.blue(),
-                timestamp=datetime.utcnow()
-            )
-            embed.set_author(name=f"Message from {message.author.name}", 
-                           icon_url=message.author.avatar.url if message.author.avatar else None)
+    # Queue a relay and claim attachment budget for every watching session up front so arrival order is kept
+    sessions = []
+    for author_id in list(dm_targets.get(message.author.id, ())):
+        dm_info = active_dms.get(author_id)
+        if dm_info:
+            touch_session(author_id, dm_info)
+            channel_id = dm_info['channel'].id if dm_info['channel'] is not None else dm_info['channel_id']
+            sessions.append((author_id, dm_info, relay_scheduler.reserve(channel_id), AttachmentBatch.claim_budget(message.attachments)))
 
-            # Handle attachments
-            files_to_send = []
-            if message.attachments:
-                for attachment in message.attachments:
-                    file_ext = os.path.splitext(attachment.filename)[1].lower()
-                    if file_ext in config['allowed_file_types']:
-                        if attachment.size <= config['max_file_size']:
-                            # Download the file content
-                            file_data = await attachment.read()
-                            # Create a discord.File object with BytesIO
-                            file = discord.File(fp=io.BytesIO(file_data), filename=attachment.filename)
-                            files_to_send.append(file)
-                            embed.add_field(name="Attachment", value=attachment.filename)
-                        else:
-                            embed.add_field(name="Error", value=f"File too large: {attachment.filename}")
-                    else:
-                        embed.add_field(name="Error", value=f"File type not allowed: {attachment.filename}")
+    try:
+        # Sessions relay side by side, so one backed-up admin channel doesn't hold up the others
+        results = await asyncio.gather(
+            *(relay_dm_response(message, *session) for session in sessions),
+            return_exceptions=True
+        )
+    finally:
+        for _, _, job, claim in sessions:
+            job.discard()
+            claim.release()
+    for (author_id, _, _, _), result in zip(sessions, results):
+        if isinstance(result, Exception):
+            print(f"Error relaying DM to session {author_id}: {result}")
+
+async def relay_dm_response(message, author_id, dm_info, job, claim):
+    """Relay a target's DM to one watching session through its queued job"""
+    try:
+        await resolve_session(dm_info)
+    except (discord.NotFound, discord.Forbidden):
+        # The target of a restored session is gone
+        job.discard()
+        await stop_dm(author_id)
+        return
+    channel = dm_info['channel']
+    
+    embed = discord.Embed(
+        description=message.content if message.content else "Sent an attachment",
+        color=discord.Color.blue(),
+        timestamp=datetime.utcnow()
+    )
+    embed.set_author(name=f"Message from {message.author.name}", 
+                   icon_url=message.author.avatar.url if message.author.avatar else None)
+
+    # A failed relay stops or skips only this session
+    try:
+        # Handle attachments
+        async with AttachmentBatch(message.attachments, dm_info, channel.guild, claim) as batch:
+            for attachment, error in batch.results:
+                if error is None:
+                    embed.add_field(name="Attachment", value=attachment.filename)
+                elif error == 'size':
+                    embed.add_field(name="Error", value=f"File too large: {attachment.filename}")
+                elif error == 'download':
+                    embed.add_field(name="Error", value=f"Could not download: {attachment.filename}")
+                else:
+                    embed.add_field(name="Error", value=f"File type not allowed: {attachment.filename}")
+
+            # Send message with any attachments; rapid text-only DMs may share one embed
+            job.submit(channel, coalesce=(author_id, message.author.id), embed=embed, files=batch.files)
+            sent_message = await job.result
+    except (discord.NotFound, discord.Forbidden):
+        # The admin channel was deleted or the bot can no longer post in it
+        job.discard()
+        await stop_dm(author_id)
+        return
+    except Exception as e:
+        # Free the job's place in line so sessions queued behind it still relay
+        job.discard()
+        print(f"Error relaying DM to session {author_id}: {e}")
+        return
 
-            # Send message with any attachments
-            sent_message = await channel.send(embed=embed, files=files_to_send)
-            
-            # Store message mapping
-            if 'message_map' not in dm_info:
-                dm_info['message_map'] = {}
-            dm_info['message_map'][sent_message.id] = message.id
+    # Store message mapping
+    dm_info['message_map'][sent_message.id] = message.id
+    await log_transcript(author_id, dm_info.get('guild_id'), 'inbound', message, sent_message, message.author.id, batch.accepted, batch.hashes)
 
 async def handle_initiator_message(message):
     """Handle outgoing messages from initiator"""
     dm_info = active_dms[message.author.id]
-    target_user = dm_info['user']
+    touch_session(message.author.id, dm_info)
     try:
-        files_to_send = []
-        
-        # Handle attachments
-        if message.attachments:
-            for attachment in message.attachments:
-                file_ext = os.path.splitext(attachment.filename)[1].lower()
-                if file_ext in config['allowed_file_types']:
-                    if attachment.size <= config['max_file_size']:
-                        # Download the file content
-                        file_data = await attachment.read()
-                        # Create a discord.File object with BytesIO
-                        file = discord.File(fp=io.BytesIO(file_data), filename=attachment.filename)
-                        files_to_send.append(file)
-                    else:
+        if 'recipients' in dm_info:
+            await broadcast_message(message, dm_info)
+            return
+
+        # Hold this message's place in the target's queue, and in line for attachment budget, while it is prepared
+        with relay_scheduler.reserve(dm_info['user'].id) as job, AttachmentBatch.claim_budget(message.attachments) as claim:
+            await resolve_session(dm_info)
+            target_user = dm_info['user']
+
+            # Handle attachments
+            async with AttachmentBatch(message.attachments, dm_info, message.guild, claim) as batch:
+                for attachment, error in batch.results:
+                    if error == 'size':
                         await message.channel.send(f"File too large to send: {attachment.filename}")
-                else:
-                    await message.channel.send(f"File type not allowed: {attachment.filename}")
-        
-        # Send message with any attachments
-        if message.content or files_to_send:
-            sent_message = await target_user.send(
-                content=message.content if message.content else None,
-                files=files_to_send
-            )
-            
-            # Store message mapping for reactions
-            if sent_message:
-                if 'message_map' not in dm_info:
-                    dm_info['message_map'] = {}
-                dm_info['message_map'][message.id] = sent_message.id
+                    elif error == 'type':
+                        await message.channel.send(f"File type not allowed: {attachment.filename}")
+                    elif error == 'download':
+                        await message.channel.send(f"Could not download: {attachment.filename}")
+
+                # Send message with any attachments
+                if message.content or batch.files:
+                    if batch.files:
+                        job.submit(target_user, content=message.content or None, files=batch.files)
+                    else:
+                        job.submit(target_user, content=message.content)
+                    sent_message = await job.result
+
+                    # Store message mapping for reactions
+                    if sent_message:
+                        dm_info['message_map'][message.id] = sent_message.id
+                    await log_transcript(message.author.id, dm_info.get('guild_id'), 'outbound', message, sent_message, target_user.id, batch.accepted, batch.hashes)
                 
     except discord.Forbidden:
         await message.channel.send("Unable to send message. The user might have blocked the bot.")
@@ -259,12 +2440,122 @@ async def handle_initiator_message(message):
     except Exception as e:
         await message.channel.send(f"Error sending message: {str(e)}")
 
+# Broadcast sessions
+BROADCAST_PROGRESS_INTERVAL = 2  # Seconds between summary embed edits
+BROADCAST_FAILURES_SHOWN = 20
+
+def broadcast_summary(outcome, total, failures, finished):
+    """Build the summary embed for a broadcast in progress or finished"""
+    embed = discord.Embed(
+        title="Broadcast Finished" if finished else "Broadcasting...",
+        color=discord.Color.green() if finished else discord.Color.blue()
+    )
+    embed.add_field(name="Delivered", value=f"{outcome['delivered']}/{total}")
+    embed.add_field(name="DMs Closed", value=outcome['blocked'])
+    embed.add_field(name="Not Found", value=outcome['not_found'])
+    embed.add_field(name="Failed", value=outcome['failed'])
+    if failures:
+        shown = "\n".join(failures[:BROADCAST_FAILURES_SHOWN])
+        if len(failures) > BROADCAST_FAILURES_SHOWN:
+            shown += f"\n...and {len(failures) - BROADCAST_FAILURES_SHOWN} more"
+        embed.add_field(name="Undelivered", value=shown, inline=False)
+    return embed
+
+async def broadcast_message(message, dm_info):
+    """Fan an initiator message out to every broadcast recipient and report the outcome"""
+    # One fan-out at a time per session, in arrival order, so every recipient gets messages in order
+    if 'broadcast_lock' not in dm_info:
+        dm_info['broadcast_lock'] = asyncio.Lock()
+    async with dm_info['broadcast_lock']:
+        async with AttachmentBatch(message.attachments, dm_info, message.guild) as batch:
+            for attachment, error in batch.results:
+                if error == 'size':
+                    await message.channel.send(f"File too large to send: {attachment.filename}")
+                elif error == 'type':
+                    await message.channel.send(f"File type not allowed: {attachment.filename}")
+                elif error == 'download':
+                    await message.channel.send(f"Could not download: {attachment.filename}")
+            if not (message.content or batch.files):
+                return
+            # Recipients each get their own file objects over the same downloaded bytes. Cached
+            # files stay open, and so pinned in the cache, until every recipient is done; spooled
+            # temp files are kept open the same way instead of being read back into memory
+            attachments = []
+            for file in batch.files:
+                if isinstance(file.fp, MappedFile):
+                    data = attachment_cache.open(file.fp.key)
+                elif isinstance(file.fp, io.BytesIO):
+                    data = file.fp.getvalue()
+                else:
+                    data = os.fdopen(os.dup(file.fp.fileno()), 'rb')
+                attachments.append((file.filename, data))
+            hashes = batch.hashes
+
+        recipients = dm_info['recipients']
+        outcome = {'delivered': 0, 'blocked': 0, 'not_found': 0, 'failed': 0}
+        failures = []
+        slots = asyncio.Semaphore(config['broadcast_concurrency'])
+
+        def open_attachment(data):
+            if isinstance(data, MappedFile):
+                return attachment_cache.open(data.key)
+            if isinstance(data, bytes):
+                return io.BytesIO(data)
+            return MappedFile(data)
+
+        async def deliver(user_id):
+            async with slots:
+                try:
+                    if recipients[user_id] is None:
+                        await broadcast_bucket.take()
+                        recipients[user_id] = await bot.create_dm(discord.Object(id=user_id))
+                    await broadcast_bucket.take()
+                    if attachments:
+                        files = [discord.File(fp=open_attachment(data), filename=filename) for filename, data in attachments]
+                        try:
+                            await relay_scheduler.send(recipients[user_id], content=message.content or None, files=files)
+                        finally:
+                            close_files(files)
+                    else:
+                        await relay_scheduler.send(recipients[user_id], content=message.content)
+                    outcome['delivered'] += 1
+                except discord.Forbidden:
+                    outcome['blocked'] += 1
+                    failures.append(f"<@{user_id}> (DMs closed)")
+                except discord.NotFound:
+                    outcome['not_found'] += 1
+                    failures.append(f"<@{user_id}> (not found)")
+                except discord.HTTPException as e:
+                    outcome['failed'] += 1
+                    failures.append(f"<@{user_id}> ({e.status})")
+                except Exception as e:
+                    outcome['failed'] += 1
+                    failures.append(f"<@{user_id}> ({type(e).__name__})")
+
+        task = asyncio.gather(*(deliver(user_id) for user_id in list(recipients)), return_exceptions=True)
+        try:
+            summary = await message.channel.send(embed=broadcast_summary(outcome, len(recipients), failures, False))
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=BROADCAST_PROGRESS_INTERVAL)
+                if done:
+                    break
+                await summary.edit(embed=broadcast_summary(outcome, len(recipients), failures, False))
+            await summary.edit(embed=broadcast_summary(outcome, len(recipients), failures, True))
+        finally:
+            # Even if the summary can't be posted, deliveries finish before the next message starts
+            await task
+            for _, data in attachments:
+                if not isinstance(data, bytes):
+                    data.close()
+        await log_transcript(message.author.id, dm_info.get('guild_id'), 'outbound', message, None, None, batch.accepted, hashes)
+
 # Modify all commands to require admin permissions
 @bot.command()
 @is_admin()
 async def status(ctx):
     """Show bot and system status"""
     sys_info = get_system_info()
+    relay_stats = relay_scheduler.stats()
     
     embed = discord.Embed(
         title="Bot Status",
@@ -279,27 +2570,52 @@ async def status(ctx):
         **Status:** 🟢 Online
         **Latency:** {round(bot.latency * 1000)}ms
         **Active DM Sessions:** {len(active_dms)}
-        **Command Prefix:** {config['prefix']}
+        **Relay Queue:** {relay_stats['queued']} messages to {relay_stats['destinations']} destinations
+        **Relay Delay:** {relay_stats['avg_delay'] * 1000:.0f}ms avg, {relay_stats['max_delay'] * 1000:.0f}ms max
+        **Command Prefix:** {ctx.prefix}
         """,
         inline=False
     )
     
     # System info
-    embed.add_field(
-        name="System Information",
-        value=f"""
+    platform_info = cached_render('status_platform', lambda: f"""
         **OS:** {sys_info['os']}
         **Python:** {sys_info['python_version']}
-        **Discord.py:** {sys_info['discord_version']}
-        **CPU Usage:** {sys_info['cpu_usage']}%
-        **Memory Usage:** {sys_info['memory_usage']}%
+        **Discord.py:** {sys_info['discord_version']}""")
+    embed.add_field(
+        name="System Information",
+        value=f"""{platform_info}
         **System Uptime:** {format_duration(sys_info['uptime'])}
         """,
         inline=False
     )
     
+    # Sampled performance metrics, rendered once per sample
+    snapshot = metrics_sampler.snapshot
+    embed.add_field(
+        name=cached_render(
+            'status_performance_title',
+            lambda: f"Performance ({format_duration(config['metrics_interval'] * config['metrics_window'])} average)"
+        ),
+        value=cached_render('status_performance', lambda: render_performance(snapshot), snapshot),
+        inline=False
+    )
+    
     await ctx.send(embed=embed)
 
+def render_performance(snapshot):
+    """Format a metrics snapshot for the status command"""
+    if snapshot is None:
+        return "Collecting metrics..."
+    return f"""
+        **CPU Usage:** {snapshot['cpu']['average']:.1f}% `{snapshot['cpu']['sparkline']}`
+        **Memory Usage:** {snapshot['memory']['average']:.1f}% `{snapshot['memory']['sparkline']}`
+        **Bot Memory:** {snapshot['rss']['latest'] / 1048576:.1f}MB `{snapshot['rss']['sparkline']}`
+        **Event Loop Lag:** {snapshot['loop_lag']['average'] * 1000:.1f}ms `{snapshot['loop_lag']['sparkline']}`
+        **Relays:** {snapshot['relay_rate']['average']:.2f}/s `{snapshot['relay_rate']['sparkline']}`
+        **Sessions:** {snapshot['sessions']['latest']} `{snapshot['sessions']['sparkline']}`
+        """
+
 @bot.command()
 @is_admin()
 async def ping(ctx):
@@ -317,12 +2633,33 @@ async def ping(ctx):
     
     await message.edit(content=None, embed=embed)
 
+@bot.command()
+@is_admin()
+async def metrics(ctx):
+    """Show average latency per relay stage and attach the full metrics"""
+    embed = discord.Embed(
+        title="Relay Metrics",
+        color=discord.Color.blue(),
+        timestamp=datetime.utcnow()
+    )
+    
+    for histogram in (dispatch_seconds, admin_check_seconds, download_seconds,
+                      relay_send_seconds, reaction_seconds, rest_seconds):
+        lines = [
+            f"**{', '.join(str(value) for _, value in labels) or 'all'}:** {count} × {average * 1000:.1f}ms avg"
+            for labels, count, average in histogram.summary()
+        ]
+        embed.add_field(name=histogram.name, value="\n".join(lines) or "No samples yet", inline=False)
+    
+    exposition = discord.File(io.BytesIO(registry.render().encode()), filename='metrics.txt')
+    await ctx.send(embed=embed, file=exposition)
+
 @bot.command()
 @is_admin()
 async def userinfo(ctx, user_id: Optional[int] = None):
     """Get information about a user"""
     try:
-        user = await bot.fetch_user(user_id) if user_id else ctx.author
+        user = await resolve_user(user_id) if user_id else ctx.author
         
         embed = discord.Embed(
             title="User Information",
@@ -338,7 +2675,7 @@ async def userinfo(ctx, user_id: Optional[int] = None):
         embed.add_field(name="Account Created", value=user.created_at.strftime("%Y-%m-%d %H:%M:%S UTC"))
         
         if isinstance(ctx.channel, discord.TextChannel):
-            member = ctx.guild.get_member(user.id)
+            member = user if isinstance(user, discord.Member) else await resolve_member(ctx.guild, user.id)
             if member:
                 embed.add_field(
                     name="Server Join Date", 
@@ -378,74 +2715,185 @@ async def clear(ctx, amount: int = 10):
     await asyncio.sleep(3)
     await msg.delete()
 
+# Backup
+BACKUP_PROGRESS_INTERVAL = 2  # Seconds between progress message edits
+BACKUP_MANIFEST = 'backup_manifest.json'
+BACKUP_GUILD_CONFIG = 'guild_config.json'  # Per-guild overrides, dumped from logs/guild_config.db
+backup_progress = None  # {'done': files_checked, 'total': files_to_check, 'packed': files_written} while a backup runs
+
+def load_backup_manifest():
+    try:
+        with open(BACKUP_MANIFEST, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_backup_manifest(manifest):
+    with open(BACKUP_MANIFEST, 'w') as f:
+        json.dump(manifest, f, indent=4)
+
+def write_backup_archive(zip_name, progress, guild_overrides, previous=None):
+    """Stream config, per-guild overrides and logs into a zip archive (runs in a worker thread)
+
+    With a previous manifest, only files whose size or modification time changed
+    are packed; the guild overrides are packed when their content changed.
+    Returns the manifest of every file covered by the backup, which is also
+    stored in the archive as manifest.json.
+    """
+    paths = ['config.json'] + [
+        os.path.join('logs', entry.name)
+        for entry in os.scandir('logs')
+        if entry.is_file() and entry.name.endswith('.json')
+    ]
+    progress['total'] = len(paths) + 1
+    manifest = {}
+    with zipfile.ZipFile(zip_name, 'w', zipfile.ZIP_DEFLATED) as archive:
+        data = json.dumps(guild_overrides, indent=4).encode()
+        digest = hashlib.sha256(data).hexdigest()
+        entry = (previous or {}).get(BACKUP_GUILD_CONFIG)
+        if entry and entry['sha256'] == digest:
+            manifest[BACKUP_GUILD_CONFIG] = entry
+        else:
+            archive.writestr(BACKUP_GUILD_CONFIG, data)
+            manifest[BACKUP_GUILD_CONFIG] = {'size': len(data), 'sha256': digest}
+            progress['packed'] += 1
+        progress['done'] += 1
+
+        for path in paths:
+            stat = os.stat(path)
+            entry = (previous or {}).get(path)
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+                manifest[path] = entry
+            else:
+                # Hash while packing so each changed file is read once
+                digest = hashlib.sha256()
+                info = zipfile.ZipInfo.from_file(path, arcname=os.path.basename(path))
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with open(path, 'rb') as src, archive.open(info, 'w') as dst:
+                    for chunk in iter(lambda: src.read(ATTACHMENT_CHUNK_SIZE), b''):
+                        digest.update(chunk)
+                        dst.write(chunk)
+                manifest[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': digest.hexdigest()}
+                progress['packed'] += 1
+            progress['done'] += 1
+            time.sleep(0)  # Let the event loop thread take the GIL between files
+        archive.writestr('manifest.json', json.dumps(manifest, indent=4))
+    return manifest
+
 @bot.command()
 @is_admin()
-async def backup(ctx):
-    """Create a backup of config and logs"""
+async def backup(ctx, mode: str = 'full'):
+    """Create a full or incremental backup of config and logs"""
+    global backup_progress
     if not ctx.author.guild_permissions.administrator:
         await ctx.send("You need administrator permissions to use this command.")
         return
-        
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    backup_dir = f'backup_{timestamp}'
-    os.makedirs(backup_dir, exist_ok=True)
-    
-    # Backup config
-    try:
-        with open('config.json', 'r') as src, open(f'{backup_dir}/config.json', 'w') as dst:
-            json.dump(json.load(src), dst, indent=4)
-    except Exception as e:
-        await ctx.send(f"Error backing up config: {str(e)}")
+
+    if mode not in ('full', 'incremental'):
+        await ctx.send("Backup mode must be `full` or `incremental`.")
         return
-    
-    # Backup logs
-    try:
-        for file in os.listdir('logs'):
-            if file.endswith('.json'):
-                os.system(f'cp logs/{file} {backup_dir}/{file}')
-    except Exception as e:
-        await ctx.send(f"Error backing up logs: {str(e)}")
+
+    if backup_progress is not None:
+        await ctx.send("A backup is already in progress. Please wait for it to finish.")
         return
-    
-    # Create zip file
+
+    backup_progress = progress = {'done': 0, 'total': 0, 'packed': 0}
+    zip_name = f'backup_{mode}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.zip'
     try:
-        import shutil
-        zip_name = f'{backup_dir}.zip'
-        shutil.make_archive(backup_dir, 'zip', backup_dir)
+        await transcript_writer.join()
+        status_message = await ctx.send("Creating backup...")
+        loop = asyncio.get_running_loop()
+        previous = await loop.run_in_executor(None, load_backup_manifest) if mode == 'incremental' else None
+        guild_overrides = await guild_config.dump()
+
+        # Build the archive off the event loop, reporting progress while it runs
+        task = loop.run_in_executor(None, write_backup_archive, zip_name, progress, guild_overrides, previous)
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=BACKUP_PROGRESS_INTERVAL)
+            if done:
+                break
+            await status_message.edit(content=f"Creating backup... {progress['done']}/{progress['total']} files")
+        manifest = task.result()
+
+        if previous is not None and progress['packed'] == 0:
+            await status_message.edit(content="No changes since the last backup.")
+            return
 
+        await status_message.edit(content=f"Backup created: {progress['packed']} of {progress['total']} files packed.")
         # Send zip file
         await ctx.send(
             "Here's your backup:",
-            file=discord.File(f'{zip_name}')
+            file=discord.File(zip_name)
         )
-        
-        # Cleanup
-        shutil.rmtree(backup_dir)
-        os.remove(zip_name)
+        # Only advance the manifest once the archive has been delivered
+        await loop.run_in_executor(None, save_backup_manifest, manifest)
     except Exception as e:
         await ctx.send(f"Error creating backup zip: {str(e)}")
+    finally:
+        backup_progress = None
+        # Cleanup
+        if os.path.exists(zip_name):
+            os.remove(zip_name)
 
 @bot.command()
 @is_admin()
 async def prefix(ctx, new_prefix: str):
-    """Change the bot's command prefix"""
+    """Change the command prefix for this server"""
     if len(new_prefix) > 3:
         await ctx.send("Prefix must be 3 characters or less.")
         return
         
-    config['prefix'] = new_prefix
-    save_config()
-    update_command_prefix()
+    await guild_config.update(ctx.guild.id, prefix=new_prefix)
     
     embed = discord.Embed(
         title="Prefix Updated",
-        description=f"Command prefix has been changed to: {new_prefix}",
+        description=f"Command prefix for this server has been changed to: {new_prefix}",
+        color=discord.Color.green()
+    )
+    await ctx.send(embed=embed)
+
+@bot.command()
+@is_admin()
+async def guildconfig(ctx, setting: Optional[str] = None, *values: str):
+    """Show or change this server's prefix and attachment settings"""
+    if setting is None:
+        settings = await guild_config.get(ctx.guild)
+        embed = discord.Embed(title="Server Configuration", color=discord.Color.blue())
+        embed.add_field(name="prefix", value=settings.prefix)
+        embed.add_field(name="max_file_size", value=f"{settings.max_file_size} bytes")
+        embed.add_field(name="allowed_file_types", value=" ".join(settings.allowed_file_types) or "None", inline=False)
+        embed.set_footer(text=f"{ctx.prefix}guildconfig <setting> [value...] changes a setting; leave out the value to use the global default")
+        await ctx.send(embed=embed)
+        return
+
+    if setting not in GUILD_CONFIG_KEYS:
+        await ctx.send(f"Setting must be one of: {', '.join(GUILD_CONFIG_KEYS)}.")
+        return
+
+    value = None
+    if values and setting == 'prefix':
+        value = values[0]
+        if len(value) > 3:
+            await ctx.send("Prefix must be 3 characters or less.")
+            return
+    elif values and setting == 'allowed_file_types':
+        value = [ext.lower() if ext.startswith('.') else f".{ext.lower()}" for ext in values]
+    elif values:
+        try:
+            value = int(values[0])
+        except ValueError:
+            value = 0
+        if value <= 0:
+            await ctx.send("File size must be a positive number of bytes.")
+            return
+
+    await guild_config.update(ctx.guild.id, **{setting: value})
+    embed = discord.Embed(
+        title="Server Configuration Updated",
+        description=f"`{setting}` is now {'set for this server' if value is not None else 'the global default'}.",
         color=discord.Color.green()
     )
     await ctx.send(embed=embed)
-    
-    # Update bot's status
-    await bot.change_presence(activity=discord.Game(name=f"{new_prefix}panel for help"))
 
 @bot.command()
 @is_admin()
@@ -456,13 +2904,15 @@ async def startmsg(ctx, user_id: int):
             await ctx.send("You already have an active DM session. Use !stopmsg first.")
             return
 
-        target_user = await bot.fetch_user(user_id)
+        target_user = await resolve_user(user_id)
+        dm_channel = await target_user.create_dm()
         
-        active_dms[ctx.author.id] = {
+        await start_dm(ctx.author.id, {
             'user': target_user,
             'channel': ctx.channel,
-            'message_map': {}
-        }
+            'dm_channel': dm_channel,
+            'message_map': MessageMap(ctx.author.id)
+        })
         
         embed = discord.Embed(
             title="DM Session Started",
@@ -483,24 +2933,73 @@ async def startmsg(ctx, user_id: int):
 async def stopmsg(ctx):
     """Stop active DM session"""
     if ctx.author.id in active_dms:
-        target_user = active_dms[ctx.author.id]['user']
+        dm_info = active_dms[ctx.author.id]
+        target_user = dm_info['user']
         await stop_dm(ctx.author.id)
         
+        if 'recipients' in dm_info:
+            description = f"Stopped broadcasting to {len(dm_info['recipients'])} recipients"
+        else:
+            description = f"Stopped messaging {getattr(target_user, 'name', target_user.id)}"
         embed = discord.Embed(
             title="DM Session Ended",
-            description=f"Stopped messaging {target_user.name}",
+            description=description,
             color=discord.Color.red()
         )
         await ctx.send(embed=embed)
     else:
         await ctx.send("No active DM session found.")
 
+@bot.command()
+@is_admin()
+async def broadcast(ctx, *targets: Union[discord.Role, int]):
+    """Start a broadcast session to users and roles"""
+    if ctx.author.id in active_dms:
+        await ctx.send("You already have an active DM session. Use !stopmsg first.")
+        return
+
+    # Lean gateway mode keeps no member lists, so request them once for this broadcast
+    members = None
+    if any(isinstance(target, discord.Role) for target in targets) and not ctx.guild.chunked:
+        members = await ctx.guild.chunk(cache=False)
+
+    recipients = {}  # {user_id: dm_channel, opened on first delivery}
+    for target in targets:
+        if isinstance(target, discord.Role):
+            role_members = target.members if members is None else [m for m in members if target in m.roles]
+            for member in role_members:
+                if not member.bot:
+                    recipients[member.id] = None
+        else:
+            recipients[target] = None
+    recipients.pop(ctx.author.id, None)
+
+    if not recipients:
+        await ctx.send("No recipients found. Mention roles or give user IDs.")
+        return
+
+    await start_dm(ctx.author.id, {
+        'user': None,
+        'recipients': recipients,
+        'channel': ctx.channel,
+        'dm_channel': None,
+        'message_map': MessageMap(ctx.author.id)
+    })
+
+    embed = discord.Embed(
+        title="Broadcast Session Started",
+        description=f"Now broadcasting to {len(recipients)} recipients",
+        color=discord.Color.green()
+    )
+    await ctx.send(embed=embed)
+
 @bot.command()
 @is_admin()
 async def export(ctx):
     """Export chat logs"""
     if ctx.author.id in active_dms:
         filename = f'logs/dm_{ctx.author.id}_{datetime.now().strftime("%Y%m%d")}.json'
+        await transcript_writer.join()
         try:
             await ctx.send("Here are your chat logs:", file=discord.File(filename))
         except FileNotFoundError:
@@ -508,6 +3007,23 @@ async def export(ctx):
     else:
         await ctx.send("No active DM session found.")
 
+@bot.command()
+@is_admin()
+async def exportlogs(ctx, user_id: int, start: Optional[str] = None, end: Optional[str] = None):
+    """Export chat logs with a user, optionally between two dates (YYYY-MM-DD)"""
+    try:
+        start_bound, end_bound = parse_date_range(start, end)
+    except ValueError:
+        await ctx.send("Dates must use the YYYY-MM-DD format.")
+        return
+    await send_transcript_export(ctx, f'dm_user_{user_id}', target_id=user_id, start=start_bound, end=end_bound)
+
+@bot.command()
+@is_admin()
+async def searchlogs(ctx, *, keyword: str):
+    """Export chat log messages containing a keyword"""
+    await send_transcript_export(ctx, 'dm_search', keyword=keyword)
+
 class PanelView(discord.ui.View):
     def __init__(self):
         super().__init__(timeout=None)  # Make buttons persistent
@@ -536,6 +3052,9 @@ class PanelView(discord.ui.View):
             emoji="💖"
         ))
 
+# Shared by every panel and help message; created and registered with the bot in setup_hook
+panel_view = None
+
 @bot.command()
 @is_admin()
 async def helpme(ctx, command: str = None):
@@ -548,28 +3067,36 @@ async def helpme(ctx, command: str = None):
     if cmd is None:
         await ctx.send(f"Command `{command}` not found.")
         return
-        
+    
+    # Add buttons to help command as well
+    embed = cached_render(('helpme', cmd.name, ctx.prefix), lambda: render_help(cmd, ctx.prefix))
+    await ctx.send(embed=embed, view=panel_view)
+
+def render_help(cmd, prefix):
+    """Build the help embed for a command"""
     embed = discord.Embed(
         title=f"Help: {cmd.name}",
-        description=cmd.helpme or "No description available.",
+        description=cmd.help or "No description available.",
         color=discord.Color.blue()
     )
     
-    usage = f"{config['prefix']}{cmd.name}"
+    usage = f"{prefix}{cmd.name}"
     if cmd.signature:
         usage += f" {cmd.signature}"
     embed.add_field(name="Usage", value=f"`{usage}`", inline=False)
     
     if cmd.aliases:
         embed.add_field(name="Aliases", value=", ".join(cmd.aliases), inline=False)
-    
-    # Add buttons to help command as well
-    view = PanelView()
-    await ctx.send(embed=embed, view=view)
+    return embed
 
 @bot.command()
 async def panel(ctx):
     """Display the command panel"""
+    embed = cached_render(('panel', ctx.prefix), lambda: render_panel(ctx.prefix))
+    await ctx.send(embed=embed, view=panel_view)
+
+def render_panel(prefix):
+    """Build the command panel embed"""
     ascii_art = """
         ██████╗  █████╗ ███╗   ██╗███████╗██╗     
         ██╔══██╗██╔══██╗████╗  ██║██╔════╝██║     
@@ -590,12 +3117,16 @@ async def panel(ctx):
     embed.add_field(
         name="вαѕι¢ ¢σммαη∂ѕ",
         value=f"""
-        `{config['prefix']}helpme [command]` - Show help for all or specific command
-        `{config['prefix']}panel` - Show this command panel
-        `{config['prefix']}startmsg <user_id>` - Start a DM session
-        `{config['prefix']}stopmsg` - Stop active DM session
-        `{config['prefix']}export` - Export chat logs
-        `{config['prefix']}prefix <new_prefix>` - Change command prefix
+        `{prefix}helpme [command]` - Show help for all or specific command
+        `{prefix}panel` - Show this command panel
+        `{prefix}startmsg <user_id>` - Start a DM session
+        `{prefix}broadcast <@role|user_id> [...]` - Start a broadcast session
+        `{prefix}stopmsg` - Stop active DM session
+        `{prefix}export` - Export chat logs
+        `{prefix}exportlogs <user_id> [from] [to]` - Export chat logs with a user
+        `{prefix}searchlogs <keyword>` - Export chat logs containing a keyword
+        `{prefix}prefix <new_prefix>` - Change command prefix
+        `{prefix}guildconfig [setting] [value...]` - Show or change this server's settings
         """,
         inline=False
     )
@@ -604,11 +3135,12 @@ async def panel(ctx):
     embed.add_field(
         name="υтιℓιту ¢σммαη∂ѕ",
         value=f"""
-        `{config['prefix']}status` - Show bot and system status
-        `{config['prefix']}ping` - Check bot latency
-        `{config['prefix']}userinfo [user_id]` - Get user information
-        `{config['prefix']}clear <amount>` - Clear messages (default: 10)
-        `{config['prefix']}backup` - Create config and logs backup
+        `{prefix}status` - Show bot and system status
+        `{prefix}ping` - Check bot latency
+        `{prefix}metrics` - Show relay latency metrics
+        `{prefix}userinfo [user_id]` - Get user information
+        `{prefix}clear <amount>` - Clear messages (default: 10)
+        `{prefix}backup [full|incremental]` - Create config and logs backup
         """,
         inline=False
     )
@@ -617,10 +3149,10 @@ async def panel(ctx):
     embed.add_field(
         name="нσω тσ υѕє",
         value=f"""
-        1. Start a DM session with `{config['prefix']}startmsg <user_id>`
+        1. Start a DM session with `{prefix}startmsg <user_id>`
            - ᴛʏᴘᴇ ᴀɴʏ ᴍᴇꜱꜱᴀɢᴇ ᴛᴏ ꜱᴇɴᴅ ɪᴛ ᴛᴏ ᴛʜᴇ ᴜꜱᴇʀ
            - ᴛʜᴇɪʀ ʀᴇᴘʟɪᴇꜱ ᴡɪʟʟ ᴀᴘᴘᴇᴀʀ ɪɴ ᴛʜɪꜱ ᴄʜᴀɴɴᴇʟ
-           - ᴜꜱᴇ `{config['prefix']}ꜱᴛᴏᴘᴍꜱɢ` ᴛᴏ ᴇɴᴅ ᴛʜᴇ ꜱᴇꜱꜱɪᴏɴ
+           - ᴜꜱᴇ `{prefix}ꜱᴛᴏᴘᴍꜱɢ` ᴛᴏ ᴇɴᴅ ᴛʜᴇ ꜱᴇꜱꜱɪᴏɴ
         """,
         inline=False
     )
@@ -631,16 +3163,170 @@ async def panel(ctx):
         value="Click the buttons below to join our community, view source code, or support development! 🚀",
         inline=False
     )
-    
-    # Create view with buttons and send
-    view = PanelView()
-    await ctx.send(embed=embed, view=view)
+    return embed
 
-async def stop_dm(author_id):
+def touch_session(author_id, dm_info):
+    """Mark a session as used; with a shared store, other processes hear of it a few times per idle TTL"""
+    now = time.monotonic()
+    dm_info['last_active'] = now
+    idle_ttl = config['session_idle_ttl']
+    if session_store.shared and idle_ttl is not None and now - dm_info.get('touched_at', 0) >= idle_ttl / 10:
+        dm_info['touched_at'] = now
+        session_store.touch(author_id)
+
+def session_target_ids(dm_info):
+    """Get the IDs of every user a session talks to"""
+    if 'recipients' in dm_info:
+        return list(dm_info['recipients'])
+    return [dm_info['user'].id]
+
+async def start_dm(author_id, dm_info, persist=True):
+    """Helper function to register a DM session and index it by target user"""
+    dm_info['last_active'] = time.monotonic()
+    # Wall clock time, so the session limit still counts from the first start after a restart
+    dm_info.setdefault('started_at', time.time())
+    if dm_info.get('guild_id') is None and getattr(dm_info['channel'], 'guild', None) is not None:
+        dm_info['guild_id'] = dm_info['channel'].guild.id
+    active_dms[author_id] = dm_info
+    for target_id in session_target_ids(dm_info):
+        dm_targets.setdefault(target_id, set()).add(author_id)
+    session_reaper.schedule(author_id, dm_info)
+    # Broadcast sessions are not saved; they end with the process
+    if persist and session_store.enabled and 'recipients' not in dm_info:
+        await session_store.save(author_id, dm_info['user'].id, dm_info['channel'].id, dm_info.get('guild_id'), int(dm_info['started_at']))
+
+async def stop_dm(author_id, persist=True):
     """Helper function to stop DM session and clean up"""
-    if author_id in active_dms:
-        del active_dms[author_id]
+    dm_info = active_dms.pop(author_id, None)
+    if dm_info:
+        for target_id in session_target_ids(dm_info):
+            authors = dm_targets.get(target_id)
+            if authors:
+                authors.discard(author_id)
+                if not authors:
+                    del dm_targets[target_id]
+        if persist:
+            await dm_info['message_map'].discard()
+            if session_store.enabled and 'recipients' not in dm_info:
+                await session_store.delete(author_id)
         
+
+# Session expiry
+class SessionReaper:
+    """End sessions that have been idle or open for too long
+
+    One task sleeps until the earliest deadline in a heap holding one entry per
+    session. Relaying a message only updates the session's last_active time;
+    when an entry comes due for a session used since, it is pushed back to the
+    new deadline, so upkeep does not grow with message volume. Entries hold
+    only IDs, so a stopped session's memory is freed right away.
+    """
+
+    def __init__(self):
+        self.heap = []  # [(deadline, sequence, author_id, generation)]
+        self._sequence = 0
+        self._generation = 0
+        self._wakeup = None
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    def deadline(self, dm_info):
+        """When a session expires, and whether that is its absolute limit, or None"""
+        deadlines = []
+        if config['session_idle_ttl'] is not None:
+            deadlines.append((dm_info['last_active'] + config['session_idle_ttl'], False))
+        if config['session_max_ttl'] is not None:
+            remaining = dm_info['started_at'] + config['session_max_ttl'] - time.time()
+            deadlines.append((time.monotonic() + remaining, True))
+        return min(deadlines, default=None)
+
+    def schedule(self, author_id, dm_info):
+        if self._task is None:
+            return
+        # The generation tells this session apart from a later one started by the same admin
+        if 'generation' not in dm_info:
+            self._generation += 1
+            dm_info['generation'] = self._generation
+        deadline = self.deadline(dm_info)
+        if deadline is None:
+            return
+        self._sequence += 1
+        heapq.heappush(self.heap, (deadline[0], self._sequence, author_id, dm_info['generation']))
+        if self.heap[0][1] == self._sequence:
+            self._wakeup.set()
+
+    def reschedule(self):
+        """Rebuild the heap after the TTL settings change"""
+        self.heap = []
+        for author_id, dm_info in list(active_dms.items()):
+            self.schedule(author_id, dm_info)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            timeout = self.heap[0][0] - time.monotonic() if self.heap else None
+            if timeout is None or timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, author_id, generation = heapq.heappop(self.heap)
+            # Skip entries for sessions that were stopped or replaced
+            dm_info = active_dms.get(author_id)
+            if dm_info is None or dm_info.get('generation') != generation:
+                continue
+            deadline = self.deadline(dm_info)
+            if deadline is None:
+                continue
+            if deadline[0] > time.monotonic():
+                self._sequence += 1
+                heapq.heappush(self.heap, (deadline[0], self._sequence, author_id, generation))
+                continue
+            try:
+                await expire_session(author_id, dm_info, deadline[1])
+            except Exception as e:
+                print(f"Error expiring session: {e}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+session_reaper = SessionReaper()
+
+async def expire_session(author_id, dm_info, reached_limit):
+    """Stop an expired session, write out its transcript and tell its admin"""
+    await stop_dm(author_id)
+    await transcript_writer.release(author_id)
+
+    if reached_limit:
+        reason = f"it reached the {format_duration(config['session_max_ttl'])} session limit"
+    else:
+        reason = f"it was idle for {format_duration(config['session_idle_ttl'])}"
+    if 'recipients' in dm_info:
+        description = f"Broadcast to {len(dm_info['recipients'])} recipients ended because {reason}."
+    else:
+        target = dm_info['user']
+        description = f"Session with {getattr(target, 'name', target.id)} ended because {reason}."
+
+    # The admin channel may be on a shard run by another process; sending only needs its ID
+    channel = dm_info['channel'] or bot.get_channel(dm_info['channel_id']) or bot.get_partial_messageable(
+        dm_info['channel_id'], guild_id=dm_info.get('guild_id')
+    )
+    embed = discord.Embed(title="DM Session Expired", description=description, color=discord.Color.orange())
+    try:
+        await channel.send(content=f"<@{author_id}>", embed=embed)
+    except discord.HTTPException as e:
+        print(f"Error announcing expired session: {e}")
+
         # Error handling for non-admin users
 @bot.event
 async def on_command_error(ctx, error):
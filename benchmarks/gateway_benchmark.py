@@ -0,0 +1,246 @@
+"""Startup benchmark for DM Interactor BOT's full and lean gateway modes
+
+Serves a fake Discord gateway with large synthetic guilds over a websocket,
+then starts the bot against it once per mode, each in its own process, and
+reports time to on_ready, resident memory and cached members. The gateway
+answers member chunk requests and includes presences when the presence
+intent is identified, as Discord does.
+
+    python benchmarks/gateway_benchmark.py --guilds 5 --members 20000 --output startup.json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+import discord
+from discord.http import Route
+import psutil
+
+from relay_benchmark import BOT_USER_ID, FakeDiscord, LoopMonitor, git_revision, json_response, load_bot, timestamp, user_payload
+
+PRESENCES_INTENT = 1 << 8
+CHUNK_SIZE = 1000
+MODES = ('full', 'lean')
+
+class FakeGateway(FakeDiscord):
+    """Fake Discord REST API plus a gateway websocket serving synthetic guilds"""
+
+    def __init__(self, guilds, members, online):
+        super().__init__(None, 0, 0, 0, 0)
+        self.guilds = guilds
+        self.members = members
+        self.online = online
+
+    def add_routes(self, app):
+        super().add_routes(app)
+        app.router.add_get('/api/v10/gateway/bot', self.get_gateway)
+        app.router.add_get('/gateway', self.gateway)
+
+    async def get_gateway(self, request):
+        return json_response({
+            'url': self.base_url.replace('http://', 'ws://') + '/gateway',
+            'shards': 1,
+            'session_start_limit': {'total': 1000, 'remaining': 1000, 'reset_after': 0, 'max_concurrency': 1}
+        })
+
+    def guild_id(self, index):
+        return 100_000 + index
+
+    def member_ids(self, guild_id):
+        base = guild_id * 1_000_000
+        return range(base, base + self.members)
+
+    def member_payload(self, user_id):
+        return {'user': user_payload(user_id), 'roles': [], 'joined_at': timestamp(), 'deaf': False, 'mute': False, 'flags': 0}
+
+    def presence_payload(self, user_id):
+        return {'user': {'id': str(user_id)}, 'status': 'online', 'activities': [], 'client_status': {'desktop': 'online'}}
+
+    def guild_create(self, index):
+        guild_id = self.guild_id(index)
+        return {
+            'id': str(guild_id),
+            'name': f'Guild {index}',
+            'owner_id': str(BOT_USER_ID + 1),
+            'member_count': self.members + 1,
+            'large': self.members > 250,
+            'unavailable': False,
+            'roles': [{'id': str(guild_id), 'name': '@everyone', 'permissions': '0', 'position': 0}],
+            'channels': [{'id': str(guild_id + 1), 'type': 0, 'name': 'general', 'position': 0, 'permission_overwrites': []}],
+            # Like Discord, large guilds only come with the bot's own member; the rest is chunked
+            'members': [self.member_payload(BOT_USER_ID)],
+            'presences': [],
+            'voice_states': [],
+            'threads': [],
+            'emojis': [],
+            'stickers': [],
+            'features': []
+        }
+
+    async def gateway(self, request):
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        sequence = 0
+
+        async def send(op, data=None, event=None):
+            nonlocal sequence
+            payload = {'op': op, 'd': data}
+            if op == 0:
+                sequence += 1
+                payload.update(s=sequence, t=event)
+            await ws.send_str(json.dumps(payload))
+
+        presences = False
+        await send(10, {'heartbeat_interval': 41250})
+        async for message in ws:
+            if message.type != web.WSMsgType.TEXT:
+                break
+            payload = json.loads(message.data)
+            op, data = payload['op'], payload['d']
+            if op == 1:
+                await send(11)
+            elif op == 2:
+                presences = bool(data['intents'] & PRESENCES_INTENT)
+                await send(0, {
+                    'v': 10,
+                    'user': dict(user_payload(BOT_USER_ID), bot=True),
+                    'guilds': [{'id': str(self.guild_id(i)), 'unavailable': True} for i in range(self.guilds)],
+                    'session_id': 'benchmark',
+                    'resume_gateway_url': self.base_url.replace('http://', 'ws://') + '/gateway',
+                    'shard': [0, 1],
+                    'application': {'id': str(BOT_USER_ID), 'flags': 0}
+                }, 'READY')
+                for i in range(self.guilds):
+                    await send(0, self.guild_create(i), 'GUILD_CREATE')
+            elif op == 8:
+                await self.send_chunks(send, int(data['guild_id']), data.get('nonce'), data.get('presences') and presences)
+        return ws
+
+    async def send_chunks(self, send, guild_id, nonce, presences):
+        member_ids = self.member_ids(guild_id)
+        chunk_count = max(1, -(-len(member_ids) // CHUNK_SIZE))
+        online = int(CHUNK_SIZE * self.online)
+        for index in range(chunk_count):
+            chunk = member_ids[index * CHUNK_SIZE:(index + 1) * CHUNK_SIZE]
+            payload = {
+                'guild_id': str(guild_id),
+                'members': [self.member_payload(user_id) for user_id in chunk],
+                'chunk_index': index,
+                'chunk_count': chunk_count,
+                'nonce': nonce
+            }
+            if presences:
+                payload['presences'] = [self.presence_payload(user_id) for user_id in chunk[:online]]
+            await send(0, payload, 'GUILD_MEMBERS_CHUNK')
+
+async def measure(base_url):
+    """Start the bot against the fake gateway and measure it until on_ready"""
+    bot_module = load_bot()
+    Route.BASE = f'{base_url}/api/v10'
+    bot = bot_module.bot
+    # The last guild is already sent; don't wait the default two seconds for more
+    bot._connection.guild_ready_timeout = 0.1
+    process = psutil.Process()
+    gc.collect()
+    rss_before = process.memory_info().rss
+
+    monitor = LoopMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    await bot.login('benchmark-token')
+    runner = asyncio.create_task(bot.connect())
+    await bot.wait_until_ready()
+    ready = time.perf_counter() - started
+    await monitor.stop()
+    gc.collect()
+    result = {
+        'lean_gateway': bot_module.config['lean_gateway'],
+        'time_to_ready': ready,
+        'rss_before_connect': rss_before,
+        'rss_ready': process.memory_info().rss,
+        'peak_rss': monitor.peak_rss,
+        'loop_lag_max': max(monitor.lags, default=None),
+        'cached_members': sum(len(guild.members) for guild in bot.guilds),
+        'cached_users': len(bot.users)
+    }
+    await bot.close()
+    await runner
+    return result
+
+def run_child(base_url, mode):
+    # The bot reads config.json from the working directory when it is imported
+    workdir = tempfile.mkdtemp(prefix='dm-bench-')
+    os.chdir(workdir)
+    try:
+        with open('config.json', 'w') as f:
+            json.dump({'lean_gateway': mode == 'lean'}, f)
+        result = asyncio.run(measure(base_url))
+    finally:
+        os.chdir('/')
+        shutil.rmtree(workdir, ignore_errors=True)
+    json.dump(result, sys.stdout)
+
+async def run(args):
+    server = FakeGateway(args.guilds, args.members, args.online)
+    await server.start()
+    results = []
+    try:
+        for mode in args.modes:
+            child = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), '--child', server.base_url, mode,
+                stdout=asyncio.subprocess.PIPE
+            )
+            stdout, _ = await child.communicate()
+            if child.returncode != 0:
+                raise RuntimeError(f"{mode} mode run failed with exit code {child.returncode}")
+            results.append(dict(json.loads(stdout.decode().strip().splitlines()[-1]), mode=mode))
+    finally:
+        await server.close()
+    return results
+
+def main():
+    if len(sys.argv) == 4 and sys.argv[1] == '--child':
+        run_child(sys.argv[2], sys.argv[3])
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--guilds', type=int, default=5, help="Synthetic guilds sent on connect")
+    parser.add_argument('--members', type=int, default=20000, help="Members per guild")
+    parser.add_argument('--online', type=float, default=0.1, help="Fraction of members with a presence")
+    parser.add_argument('--modes', type=lambda value: value.split(','), default=list(MODES), help="Comma-separated modes: full, lean")
+    parser.add_argument('--output', help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(f"{'mode':>6} {'ready s':>8} {'rss MB':>8} {'peak MB':>8} {'members':>9}", file=sys.stderr)
+    for result in results:
+        print(
+            f"{result['mode']:>6} {result['time_to_ready']:>8.2f} {result['rss_ready'] / 1048576:>8.1f} "
+            f"{result['peak_rss'] / 1048576:>8.1f} {result['cached_members']:>9}",
+            file=sys.stderr
+        )
+    report = {
+        'timestamp': timestamp(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'discord': discord.__version__,
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+
+if __name__ == "__main__":
+    main()
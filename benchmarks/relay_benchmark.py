@@ -0,0 +1,530 @@
+"""End-to-end relay benchmark for DM Interactor BOT
+
+Drives the bot's real on_message, on_raw_reaction_add, handle_dm_response and
+handle_initiator_message code paths. Gateway events are fed straight into
+discord.py's event parsers, and every REST and CDN request goes to a fake
+Discord server on localhost with configurable latency and rate limits.
+
+Each combination of --sessions, --attachment-size and --reaction-rate is run
+as one scenario. Results are printed as a table and written as JSON:
+
+    python benchmarks/relay_benchmark.py --sessions 1,10,50 --attachment-size 0,262144 --output results.json
+"""
+import argparse
+import asyncio
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from aiohttp import web
+import discord
+from discord.http import Route
+import psutil
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_PATH = os.path.join(REPO_DIR, 'DM Interactor BOT.py')
+TOKEN_PATTERN = re.compile(r'bench-(\d+)')
+BOT_USER_ID = 1000
+LAG_INTERVAL = 0.01
+
+def int_list(value):
+    return [int(part) for part in value.split(',')]
+
+def float_list(value):
+    return [float(part) for part in value.split(',')]
+
+def config_override(value):
+    key, _, raw = value.partition('=')
+    return key, json.loads(raw)
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def timestamp():
+    return datetime.now(timezone.utc).isoformat()
+
+def user_payload(user_id):
+    return {'id': str(user_id), 'username': f'user{user_id}', 'discriminator': '0', 'avatar': None, 'global_name': None}
+
+def json_response(data, status=200, headers=None):
+    # discord.py only decodes JSON when the content type carries no charset
+    headers = dict(headers or {}, **{'Content-Type': 'application/json'})
+    return web.Response(body=json.dumps(data).encode(), status=status, headers=headers)
+
+def load_bot():
+    """Import the bot script as a module; it reads and writes config and logs in the working directory"""
+    spec = importlib.util.spec_from_file_location('dm_interactor_bot', BOT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class FakeDiscord:
+    """Local stand-in for Discord's REST API and attachment CDN
+
+    Message creation is limited per channel to rest_limit requests per
+    rest_window seconds, answered with rate limit headers and 429s the way
+    Discord does. Every relayed benchmark token is timestamped on arrival.
+    """
+
+    def __init__(self, ids, latency, rest_limit, rest_window, max_attachment):
+        self.ids = ids
+        self.latency = latency
+        self.rest_limit = rest_limit
+        self.rest_window = rest_window
+        self.blob = os.urandom(max_attachment)
+        self.windows = {}  # {bucket key: [remaining, reset_at]}
+        self.received = {}  # {token: arrival time}
+        self.message_ids = {}  # {token: id of the message that carried it}
+        self.reactions = {}  # {message_id: arrival time}
+        self.requests = 0
+        self.rate_limited = 0
+        self.uploaded = 0
+        self.base_url = None
+        self.runner = None
+
+    async def start(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        self.add_routes(app)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f'http://127.0.0.1:{port}'
+
+    def add_routes(self, app):
+        app.router.add_get('/api/v10/users/@me', self.get_me)
+        app.router.add_get('/api/v10/oauth2/applications/@me', self.get_application)
+        app.router.add_get('/api/v10/users/{user_id}', self.get_user)
+        app.router.add_post('/api/v10/users/@me/channels', self.create_dm)
+        app.router.add_post('/api/v10/channels/{channel_id}/messages', self.create_message)
+        app.router.add_route('*', '/api/v10/channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me', self.react)
+        app.router.add_get('/attachments/{token}/{size}/{filename}', self.download)
+
+    async def close(self):
+        await self.runner.cleanup()
+
+    def check_rate_limit(self, key):
+        """Return (headers, retry_after); retry_after is None when the request may proceed"""
+        if not self.rest_limit:
+            return {}, None
+        now = time.monotonic()
+        window = self.windows.get(key)
+        if window is None or window[1] <= now:
+            window = self.windows[key] = [self.rest_limit, now + self.rest_window]
+        reset_after = window[1] - now
+        headers = {
+            'X-RateLimit-Limit': str(self.rest_limit),
+            'X-RateLimit-Bucket': key,
+            'X-RateLimit-Reset-After': f'{reset_after:.3f}',
+            'Via': '1.1 google'
+        }
+        if window[0] == 0:
+            headers['X-RateLimit-Remaining'] = '0'
+            return headers, reset_after
+        window[0] -= 1
+        headers['X-RateLimit-Remaining'] = str(window[0])
+        return headers, None
+
+    async def get_me(self, request):
+        await asyncio.sleep(self.latency)
+        return json_response(dict(user_payload(BOT_USER_ID), bot=True))
+
+    async def get_application(self, request):
+        await asyncio.sleep(self.latency)
+        return json_response({
+            'id': str(BOT_USER_ID),
+            'name': 'Benchmark',
+            'description': '',
+            'icon': None,
+            'bot_public': False,
+            'bot_require_code_grant': False,
+            'owner': user_payload(BOT_USER_ID + 1),
+            'verify_key': '',
+            'flags': 0
+        })
+
+    async def get_user(self, request):
+        await asyncio.sleep(self.latency)
+        return json_response(user_payload(int(request.match_info['user_id'])))
+
+    async def create_dm(self, request):
+        await asyncio.sleep(self.latency)
+        recipient_id = int((await request.json())['recipient_id'])
+        # DM channel IDs mirror the recipient's ID so events can be built without a lookup
+        return json_response({'id': str(recipient_id + 1), 'type': 1, 'recipients': [user_payload(recipient_id)]})
+
+    async def create_message(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        channel_id = request.match_info['channel_id']
+        headers, retry_after = self.check_rate_limit(f'messages:{channel_id}')
+        if retry_after is not None:
+            self.rate_limited += 1
+            body = {'message': 'You are being rate limited.', 'retry_after': retry_after, 'global': False}
+            return json_response(body, status=429, headers=headers)
+
+        if request.content_type.startswith('multipart/'):
+            payload = {}
+            async for part in await request.multipart():
+                if part.name == 'payload_json':
+                    payload = json.loads(await part.text())
+                else:
+                    self.uploaded += len(await part.read())
+        else:
+            payload = await request.json()
+
+        message_id = next(self.ids)
+        now = time.perf_counter()
+        for token in TOKEN_PATTERN.findall(json.dumps(payload)):
+            self.received[int(token)] = now
+            self.message_ids[int(token)] = message_id
+        return json_response({
+            'id': str(message_id),
+            'channel_id': channel_id,
+            'type': 0,
+            'author': dict(user_payload(BOT_USER_ID), bot=True),
+            'content': payload.get('content') or '',
+            'embeds': payload.get('embeds', []),
+            'attachments': [],
+            'mentions': [],
+            'mention_roles': [],
+            'mention_everyone': False,
+            'pinned': False,
+            'tts': False,
+            'timestamp': timestamp(),
+            'edited_timestamp': None
+        }, headers=headers)
+
+    async def react(self, request):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        self.reactions[int(request.match_info['message_id'])] = time.perf_counter()
+        return web.Response(status=204)
+
+    async def download(self, request):
+        await asyncio.sleep(self.latency)
+        size = int(request.match_info['size'])
+        return web.Response(body=self.blob[:size], content_type='application/octet-stream')
+
+class LoopMonitor:
+    """Sample event loop lag and peak resident memory while a scenario runs"""
+
+    def __init__(self):
+        self.lags = []
+        self.peak_rss = 0
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        process = psutil.Process()
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + LAG_INTERVAL
+            await asyncio.sleep(LAG_INTERVAL)
+            self.lags.append(max(0.0, loop.time() - expected))
+            self.peak_rss = max(self.peak_rss, process.memory_info().rss)
+
+    async def stop(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+class Benchmark:
+    """Fake gateway that builds sessions and injects DM, channel and reaction events"""
+
+    def __init__(self, bot_module, server, ids, args):
+        self.bot_module = bot_module
+        self.bot = bot_module.bot
+        self.state = bot_module.bot._connection
+        self.server = server
+        self.ids = ids
+        self.args = args
+        self.scenario_ids = itertools.count(1)
+
+    def message_payload(self, channel_id, author_id, content, attachment_size, guild_id=None, role_id=None):
+        message_id = next(self.ids)
+        payload = {
+            'id': str(message_id),
+            'channel_id': str(channel_id),
+            'type': 0,
+            'author': user_payload(author_id),
+            'content': content,
+            'attachments': [],
+            'embeds': [],
+            'mentions': [],
+            'mention_roles': [],
+            'mention_everyone': False,
+            'pinned': False,
+            'tts': False,
+            'timestamp': timestamp(),
+            'edited_timestamp': None
+        }
+        if guild_id is not None:
+            payload['guild_id'] = str(guild_id)
+            payload['member'] = {'roles': [str(role_id)], 'joined_at': timestamp(), 'deaf': False, 'mute': False, 'flags': 0}
+        if attachment_size:
+            token = TOKEN_PATTERN.search(content).group(1)
+            payload['attachments'].append({
+                'id': str(next(self.ids)),
+                'filename': 'bench.png',
+                'size': attachment_size,
+                'url': f'{self.server.base_url}/attachments/{token}/{attachment_size}/bench.png',
+                'proxy_url': f'{self.server.base_url}/attachments/{token}/{attachment_size}/bench.png'
+            })
+        return message_id, payload
+
+    async def create_sessions(self, count):
+        """Create a guild with one admin, channel and DM target per session"""
+        base = next(self.scenario_ids) * 10_000_000
+        guild_id, role_id = base, base + 1
+        sessions = [(base + 1000 + i * 10, base + 1001 + i * 10, base + 1003 + i * 10) for i in range(count)]
+        guild = self.state._add_guild_from_data({
+            'id': str(guild_id),
+            'name': 'Benchmark',
+            'owner_id': str(BOT_USER_ID),
+            'member_count': count + 1,
+            'roles': [
+                {'id': str(guild_id), 'name': '@everyone', 'permissions': '0', 'position': 0},
+                {'id': str(role_id), 'name': 'Admin', 'permissions': '8', 'position': 1}
+            ],
+            'channels': [
+                {'id': str(channel_id), 'type': 0, 'name': f'relay-{channel_id}', 'position': i, 'permission_overwrites': []}
+                for i, (_, _, channel_id) in enumerate(sessions)
+            ],
+            'members': [
+                {'user': user_payload(admin_id), 'roles': [str(role_id)], 'joined_at': timestamp(), 'deaf': False, 'mute': False, 'flags': 0}
+                for admin_id, _, _ in sessions
+            ]
+        })
+
+        for admin_id, target_id, channel_id in sessions:
+            target = self.state.store_user(user_payload(target_id))
+            dm_channel = await target.create_dm()
+            await self.bot_module.start_dm(admin_id, {
+                'user': target,
+                'channel': guild.get_channel(channel_id),
+                'dm_channel': dm_channel,
+                'message_map': self.bot_module.MessageMap(admin_id)
+            })
+        return guild_id, role_id, sessions
+
+    async def drive_session(self, session, guild_id, role_id, attachment_size, injected, outbound):
+        """Alternate channel messages from the admin and DMs from the target at message_rate"""
+        admin_id, target_id, channel_id = session
+        for i in range(self.args.messages):
+            token = next(self.ids)
+            content = f'bench-{token}'
+            if i % 2 == 0:
+                message_id, payload = self.message_payload(channel_id, admin_id, content, attachment_size, guild_id, role_id)
+                outbound.append((admin_id, channel_id, message_id, token))
+            else:
+                _, payload = self.message_payload(target_id + 1, target_id, content, attachment_size)
+            injected[token] = time.perf_counter()
+            self.state.parsers['MESSAGE_CREATE'](payload)
+            await asyncio.sleep(1 / self.args.message_rate)
+
+    async def drive_reactions(self, guild_id, reaction_rate, outbound, reacted, done):
+        """Mirror reactions on relayed admin messages at reaction_rate per second"""
+        seen = set()
+        while not done.is_set():
+            await asyncio.sleep(1 / reaction_rate)
+            for admin_id, channel_id, message_id, token in reversed(outbound):
+                target_message_id = self.server.message_ids.get(token)
+                if target_message_id is None or target_message_id in seen:
+                    continue
+                seen.add(target_message_id)
+                reacted[target_message_id] = time.perf_counter()
+                self.state.parsers['MESSAGE_REACTION_ADD']({
+                    'user_id': str(admin_id),
+                    'channel_id': str(channel_id),
+                    'message_id': str(message_id),
+                    'guild_id': str(guild_id),
+                    'emoji': {'id': None, 'name': '👍'},
+                    'burst': False,
+                    'type': 0
+                })
+                break
+
+    async def wait_for(self, expected, received):
+        deadline = time.perf_counter() + self.args.timeout
+        while time.perf_counter() < deadline and any(key not in received for key in expected):
+            await asyncio.sleep(0.05)
+
+    async def run_scenario(self, sessions, attachment_size, reaction_rate):
+        guild_id, role_id, session_ids = await self.create_sessions(sessions)
+        stages_before = self.stage_totals()
+        requests_before, limited_before = self.server.requests, self.server.rate_limited
+        injected, outbound, reacted = {}, [], {}
+        done = asyncio.Event()
+
+        monitor = LoopMonitor()
+        monitor.start()
+        started = time.perf_counter()
+        reactions = None
+        if reaction_rate:
+            reactions = asyncio.create_task(self.drive_reactions(guild_id, reaction_rate, outbound, reacted, done))
+        await asyncio.gather(*(
+            self.drive_session(session, guild_id, role_id, attachment_size, injected, outbound)
+            for session in session_ids
+        ))
+        await self.wait_for(injected, self.server.received)
+        elapsed = time.perf_counter() - started
+        done.set()
+        if reactions is not None:
+            await reactions
+            await self.wait_for(reacted, self.server.reactions)
+        await monitor.stop()
+
+        for admin_id, _, _ in session_ids:
+            await self.bot_module.stop_dm(admin_id)
+
+        latencies = [self.server.received[token] - sent for token, sent in injected.items() if token in self.server.received]
+        reaction_latencies = [
+            self.server.reactions[message_id] - sent for message_id, sent in reacted.items() if message_id in self.server.reactions
+        ]
+        return {
+            'sessions': sessions,
+            'attachment_size': attachment_size,
+            'reaction_rate': reaction_rate,
+            'messages': len(injected),
+            'relayed': len(latencies),
+            'lost': len(injected) - len(latencies),
+            'duration': elapsed,
+            'messages_per_second': len(latencies) / elapsed,
+            'latency_p50': percentile(latencies, 0.5),
+            'latency_p99': percentile(latencies, 0.99),
+            'reactions': len(reacted),
+            'reaction_latency_p50': percentile(reaction_latencies, 0.5),
+            'reaction_latency_p99': percentile(reaction_latencies, 0.99),
+            'loop_lag_p99': percentile(monitor.lags, 0.99),
+            'loop_lag_max': max(monitor.lags, default=None),
+            'peak_rss': monitor.peak_rss,
+            'rest_requests': self.server.requests - requests_before,
+            'rest_rate_limited': self.server.rate_limited - limited_before,
+            'stages': self.stage_delta(stages_before)
+        }
+
+    def stage_totals(self):
+        """Current (count, sum) of every relay stage histogram"""
+        totals = {}
+        for metric in self.bot_module.registry.metrics:
+            if isinstance(metric, self.bot_module.Histogram):
+                for labels, series in metric.values.items():
+                    name = metric.name + self.bot_module.format_labels(labels)
+                    totals[name] = (series[-2], series[-1])
+        return totals
+
+    def stage_delta(self, before):
+        """Average seconds per relay stage observed since before"""
+        stages = {}
+        for name, (count, total) in self.stage_totals().items():
+            count_before, total_before = before.get(name, (0, 0.0))
+            if count > count_before:
+                stages[name] = {'count': count - count_before, 'average': (total - total_before) / (count - count_before)}
+        return stages
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_table(results):
+    header = f"{'sessions':>8} {'attach':>8} {'react/s':>7} {'msg/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'lag p99':>8} {'rss MB':>7} {'429s':>5} {'lost':>5}"
+    print(header, file=sys.stderr)
+    for result in results:
+        print(
+            f"{result['sessions']:>8} {result['attachment_size']:>8} {result['reaction_rate']:>7g} "
+            f"{result['messages_per_second']:>8.1f} {(result['latency_p50'] or 0) * 1000:>8.1f} "
+            f"{(result['latency_p99'] or 0) * 1000:>8.1f} {(result['loop_lag_p99'] or 0) * 1000:>8.1f} "
+            f"{result['peak_rss'] / 1048576:>7.1f} {result['rest_rate_limited']:>5} {result['lost']:>5}",
+            file=sys.stderr
+        )
+
+async def run(args, bot_module):
+    ids = itertools.count(discord.utils.time_snowflake(datetime.now(timezone.utc)))
+    server = FakeDiscord(ids, args.latency, args.rest_limit, args.rest_window, max(args.attachment_size))
+    await server.start()
+    Route.BASE = f'{server.base_url}/api/v10'
+
+    bot_module.config.update(args.config)
+    bot = bot_module.bot
+    await bot.login('benchmark-token')
+    benchmark = Benchmark(bot_module, server, ids, args)
+    results = []
+    try:
+        for sessions, attachment_size, reaction_rate in itertools.product(
+            args.sessions, args.attachment_size, args.reaction_rate
+        ):
+            results.append(await benchmark.run_scenario(sessions, attachment_size, reaction_rate))
+    finally:
+        await bot.close()
+        await server.close()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int_list, default=[1, 10, 50], help="Comma-separated session counts")
+    parser.add_argument('--attachment-size', type=int_list, default=[0, 262144], help="Comma-separated attachment sizes in bytes; 0 sends text only")
+    parser.add_argument('--reaction-rate', type=float_list, default=[0, 10], help="Comma-separated reactions per second across all sessions")
+    parser.add_argument('--messages', type=int, default=10, help="Messages per session, alternating channel messages and DMs")
+    parser.add_argument('--message-rate', type=float, default=2.0, help="Messages per second per session")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds added to every fake REST and CDN response")
+    parser.add_argument('--rest-limit', type=int, default=5, help="Message creations allowed per channel per window; 0 disables rate limiting")
+    parser.add_argument('--rest-window', type=float, default=5.0, help="Rate limit window in seconds")
+    parser.add_argument('--timeout', type=float, default=120.0, help="Seconds to wait for relays after the last message")
+    parser.add_argument('--config', type=config_override, action='append', default=[], metavar='KEY=JSON', help="Override a bot config value")
+    parser.add_argument('--output', help="Write JSON results to this file instead of stdout")
+    args = parser.parse_args()
+    args.config = dict(args.config)
+
+    # The bot keeps its config, logs and spooled files in the working directory
+    workdir = tempfile.mkdtemp(prefix='dm-bench-')
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        bot_module = load_bot()
+        results = asyncio.run(run(args, bot_module))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(results)
+    report = {
+        'timestamp': timestamp(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'discord': discord.__version__,
+        'parameters': {
+            key: value for key, value in vars(args).items() if key != 'output'
+        },
+        'results': results
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import importlib.util
+import os
+
+import pytest
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'DM Interactor BOT.py')
+
+@pytest.fixture
+def bot_module(tmp_path, monkeypatch):
+    """Import a fresh copy of the bot script; it reads and writes config and logs in the working directory"""
+    monkeypatch.chdir(tmp_path)
+    spec = importlib.util.spec_from_file_location('dm_interactor_bot', BOT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.config['persist_sessions'] = False
+    return module
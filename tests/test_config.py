@@ -0,0 +1,26 @@
+import asyncio
+import json
+
+def test_broadcast_rate_applies_live(bot_module):
+    """An outside edit to broadcast_rate re-paces broadcasts without a restart"""
+    bot_module.config['config_reload_interval'] = 0.01
+    with open('config.json') as f:
+        edited = json.load(f)
+    edited['broadcast_rate'] = 5
+    edited['config_reload_interval'] = 0.01
+
+    async def main():
+        bot_module.config_watcher.start()
+        try:
+            bot_module.write_config_file(edited)
+            for _ in range(100):
+                if bot_module.config['broadcast_rate'] == 5:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            await bot_module.config_watcher.close()
+
+    asyncio.run(main())
+    assert bot_module.config['broadcast_rate'] == 5
+    assert bot_module.broadcast_bucket.rate == 5
+    assert bot_module.broadcast_bucket.burst == 5
@@ -0,0 +1,164 @@
+import asyncio
+import io
+
+import discord
+
+class FakeChannel:
+    guild = None
+
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.sent = []
+
+    async def send(self, **kwargs):
+        self.sent.append(kwargs)
+        return discord.Object(id=len(self.sent))
+
+class FakeUser:
+    def __init__(self, user_id):
+        self.id = user_id
+        self.name = f'user{user_id}'
+        self.avatar = None
+
+class FakeAttachment:
+    def __init__(self, attachment_id, size):
+        self.id = attachment_id
+        self.size = size
+        self.filename = f'{attachment_id}.txt'
+        self.url = f'https://cdn.example/{attachment_id}.txt'
+
+class FakeMessage:
+    def __init__(self, message_id, author, content, attachments=()):
+        self.id = message_id
+        self.author = author
+        self.content = content
+        self.attachments = list(attachments)
+
+def stub_relay_io(bot_module):
+    async def download_attachment(attachment, max_file_size):
+        return discord.File(fp=io.BytesIO(b'x' * attachment.size), filename=attachment.filename)
+
+    async def log_transcript(*args, **kwargs):
+        pass
+
+    bot_module.download_attachment = download_attachment
+    bot_module.log_transcript = log_transcript
+
+def test_attachment_budget_follows_queue_order(bot_module):
+    """A later, smaller relay must not take budget ahead of an earlier one queued before it on the same channel"""
+    bot_module.config.update(attachment_inflight_budget=2, attachment_spool_size=1, attachment_cache_size=0, relay_rate=0)
+    stub_relay_io(bot_module)
+    target = FakeUser(50)
+    channel = FakeChannel(7)
+
+    async def main():
+        await bot_module.start_dm(10, {'user': target, 'channel': channel, 'dm_channel': None, 'message_map': bot_module.MessageMap(10)})
+        # Another relay holds half the budget while both DMs arrive
+        other = bot_module.attachment_budget.claim(1)
+        first = asyncio.create_task(bot_module.handle_dm_response(
+            FakeMessage(1, target, 'first', [FakeAttachment(101, 1), FakeAttachment(102, 1)])
+        ))
+        second = asyncio.create_task(bot_module.handle_dm_response(
+            FakeMessage(2, target, 'second', [FakeAttachment(103, 1)])
+        ))
+        await asyncio.sleep(0.05)
+        other.release()
+        await asyncio.wait_for(asyncio.gather(first, second), 5)
+
+    asyncio.run(main())
+    assert [kwargs['embed'].description for kwargs in channel.sent] == ['first', 'second']
+    assert bot_module.attachment_budget.in_use == 0
+    assert not bot_module.attachment_budget.waiting
+
+def test_backed_up_channel_does_not_delay_other_sessions(bot_module):
+    """Every admin watching a target gets the DM even while another admin's channel is stuck"""
+    bot_module.config.update(relay_rate=0)
+    stub_relay_io(bot_module)
+    target = FakeUser(50)
+    stuck, idle = FakeChannel(7), FakeChannel(8)
+    unblock = None
+
+    async def stuck_send(**kwargs):
+        await unblock.wait()
+        return await FakeChannel.send(stuck, **kwargs)
+    stuck.send = stuck_send
+
+    async def main():
+        nonlocal unblock
+        unblock = asyncio.Event()
+        await bot_module.start_dm(10, {'user': target, 'channel': stuck, 'dm_channel': None, 'message_map': bot_module.MessageMap(10)})
+        await bot_module.start_dm(11, {'user': target, 'channel': idle, 'dm_channel': None, 'message_map': bot_module.MessageMap(11)})
+        relay = asyncio.create_task(bot_module.handle_dm_response(FakeMessage(1, target, 'hello')))
+        await asyncio.sleep(0.05)
+        assert [kwargs['embed'].description for kwargs in idle.sent] == ['hello']
+        unblock.set()
+        await asyncio.wait_for(relay, 5)
+
+    asyncio.run(main())
+    assert len(stuck.sent) == 1
+
+def test_failed_download_is_reported_per_file(bot_module):
+    """One attachment failing to download still relays the text and the other files"""
+    bot_module.config.update(attachment_cache_size=0, relay_rate=0)
+    stub_relay_io(bot_module)
+    download = bot_module.download_attachment
+
+    async def flaky_download(attachment, max_file_size):
+        if attachment.id == 102:
+            raise ValueError(f"File too large: {attachment.filename}")
+        return await download(attachment, max_file_size)
+    bot_module.download_attachment = flaky_download
+    target = FakeUser(50)
+    channel = FakeChannel(7)
+
+    async def main():
+        await bot_module.start_dm(10, {'user': target, 'channel': channel, 'dm_channel': None, 'message_map': bot_module.MessageMap(10)})
+        await asyncio.wait_for(bot_module.handle_dm_response(
+            FakeMessage(1, target, 'two files', [FakeAttachment(101, 4), FakeAttachment(102, 4)])
+        ), 5)
+
+    asyncio.run(main())
+    sent, = channel.sent
+    assert sent['embed'].description == 'two files'
+    assert [(field.name, field.value) for field in sent['embed'].fields] == [
+        ('Attachment', '101.txt'), ('Error', 'Could not download: 102.txt')
+    ]
+    assert [file.filename for file in sent['files']] == ['101.txt']
+
+def test_broadcast_streams_spooled_attachments(bot_module):
+    """Attachments spooled to a temp file are uploaded to every recipient from the file, not from a copy in memory"""
+    bot_module.config.update(attachment_cache_size=0, attachment_spool_size=4, relay_rate=0, broadcast_rate=0)
+    stub_relay_io(bot_module)
+
+    async def spooled_download(attachment, max_file_size):
+        fp = bot_module.tempfile.TemporaryFile(dir='files')
+        fp.write(b'y' * attachment.size)
+        fp.seek(0)
+        return discord.File(fp=fp, filename=attachment.filename)
+    bot_module.download_attachment = spooled_download
+
+    class Recipient(FakeChannel):
+        async def send(self, **kwargs):
+            file, = kwargs['files']
+            self.sent.append((type(file.fp), file.fp.read()))
+            return discord.Object(id=len(self.sent))
+
+    class Summary:
+        async def edit(self, **kwargs):
+            pass
+
+    class AdminChannel:
+        async def send(self, *args, **kwargs):
+            return Summary()
+
+    recipients = {user_id: Recipient(user_id) for user_id in (201, 202, 203)}
+    message = FakeMessage(1, FakeUser(10), 'announcement', [FakeAttachment(101, 64)])
+    message.channel = AdminChannel()
+    message.guild = None
+
+    async def main():
+        await asyncio.wait_for(bot_module.broadcast_message(message, {'recipients': dict(recipients)}), 5)
+
+    asyncio.run(main())
+    for recipient in recipients.values():
+        assert recipient.sent == [(bot_module.MappedFile, b'y' * 64)]
@@ -0,0 +1,174 @@
+import asyncio
+
+import pytest
+
+class RedisStandIn:
+    """Enough of a Redis server for the shared session store: hashes, pub/sub and error replies
+
+    SLOWPING answers after a delay and BADREPLY answers with a malformed
+    reply, to exercise a pipeline that is cut short.
+    """
+
+    def __init__(self):
+        self.hashes = {}
+        self.subscribers = {}  # {channel: [writer]}
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, '127.0.0.1', 0)
+        return f'redis://127.0.0.1:{self.server.sockets[0].getsockname()[1]}'
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @classmethod
+    def encode(cls, value):
+        if value is None:
+            return b'$-1\r\n'
+        if isinstance(value, int):
+            return b':%d\r\n' % value
+        if isinstance(value, list):
+            return b'*%d\r\n' % len(value) + b''.join(cls.encode(item) for item in value)
+        value = value.encode()
+        return b'$%d\r\n%s\r\n' % (len(value), value)
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                args = []
+                for _ in range(int(line[1:])):
+                    length = int((await reader.readline())[1:])
+                    args.append((await reader.readexactly(length + 2))[:-2].decode())
+                writer.write(await self._reply(args[0].upper(), args[1:], writer))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for writers in self.subscribers.values():
+                if writer in writers:
+                    writers.remove(writer)
+            writer.close()
+
+    async def _reply(self, command, args, writer):
+        if command == 'HSET':
+            fields = self.hashes.setdefault(args[0], {})
+            added = sum(field not in fields for field in args[1::2])
+            fields.update(zip(args[1::2], args[2::2]))
+            return self.encode(added)
+        if command == 'HGET':
+            return self.encode(self.hashes.get(args[0], {}).get(args[1]))
+        if command == 'HDEL':
+            fields = self.hashes.get(args[0], {})
+            return self.encode(sum(fields.pop(field, None) is not None for field in args[1:]))
+        if command == 'HGETALL':
+            return self.encode([item for pair in self.hashes.get(args[0], {}).items() for item in pair])
+        if command == 'DEL':
+            return self.encode(sum(self.hashes.pop(key, None) is not None for key in args))
+        if command == 'PUBLISH':
+            writers = self.subscribers.get(args[0], [])
+            for subscriber in writers:
+                subscriber.write(self.encode(['message', args[0], args[1]]))
+            return self.encode(len(writers))
+        if command == 'SUBSCRIBE':
+            self.subscribers.setdefault(args[0], []).append(writer)
+            return self.encode(['subscribe', args[0], 1])
+        if command == 'SLOWPING':
+            await asyncio.sleep(0.2)
+            return b'+PONG\r\n'
+        if command == 'BADREPLY':
+            return b'?what\r\n'
+        return f'-ERR unknown command \'{command}\'\r\n'.encode()
+
+def run_with_redis(bot_module, test):
+    async def main():
+        redis = RedisStandIn()
+        url = await redis.start()
+        try:
+            await test(redis, url)
+        finally:
+            await redis.close()
+    asyncio.run(main())
+
+def test_sessions_and_mappings_round_trip(bot_module):
+    """Sessions are saved with HSET and loaded with HGETALL; mappings are flushed and read back with HGET"""
+    async def test(redis, url):
+        store = bot_module.RedisSessionStore(url)
+        try:
+            await store.save(1, 100, 200, 300, 1700000000)
+            await store.save(2, 101, 201, None, 1700000001)
+            assert sorted(await store.load()) == [(1, 100, 200, 300, 1700000000), (2, 101, 201, None, 1700000001)]
+            await store.delete(2)
+            assert await store.load() == [(1, 100, 200, 300, 1700000000)]
+
+            store.add_mapping(1, 5000, 6000)
+            await store.flush()
+            assert not store.pending
+            assert await store.lookup_mapping(1, 5000) == 6000
+            assert await store.lookup_mapping(1, 5001) is None
+            await store.discard_mappings(1)
+            assert await store.lookup_mapping(1, 5000) is None
+        finally:
+            await store.close()
+
+    run_with_redis(bot_module, test)
+
+def test_session_events_reach_other_processes(bot_module):
+    """Starts, stops and touches are published and delivered to every other store, but not back to the sender"""
+    async def test(redis, url):
+        sender, receiver = bot_module.RedisSessionStore(url), bot_module.RedisSessionStore(url)
+        sender_events, receiver_events = asyncio.Queue(), asyncio.Queue()
+
+        async def on_sender_event(*event):
+            sender_events.put_nowait(event)
+
+        async def on_receiver_event(*event):
+            receiver_events.put_nowait(event)
+        try:
+            await sender.listen(on_sender_event)
+            await receiver.listen(on_receiver_event)
+            # Wait until both subscriptions are registered
+            while len(redis.subscribers.get(sender.EVENTS_CHANNEL, ())) < 2:
+                await asyncio.sleep(0.01)
+
+            await sender.save(1, 100, 200, 300, 1700000000)
+            sender.touch(1)
+            await sender.flush()
+            await sender.delete(1)
+            events = [await asyncio.wait_for(receiver_events.get(), 2) for _ in range(3)]
+            assert events[0] == ('start', 1, 100, 200, 300, 1700000000)
+            assert ('touch', 1) in events and ('stop', 1) in events
+            assert sender_events.empty()
+        finally:
+            await sender.close()
+            await receiver.close()
+
+    run_with_redis(bot_module, test)
+
+def test_error_replies_and_broken_pipelines(bot_module):
+    """Error replies raise without desyncing the connection, and a pipeline cut short closes it"""
+    async def test(redis, url):
+        connection = bot_module.RedisConnection(*url[len('redis://'):].split(':'))
+        try:
+            with pytest.raises(bot_module.SessionStoreError, match='unknown command'):
+                await connection.execute(('HSET', 'h', 'a', '1'), ('NOPE',), ('HSET', 'h', 'b', '2'))
+            # Every reply of the failed pipeline was read, so later commands get their own
+            assert await connection.execute(('HGET', 'h', 'a'), ('HGET', 'h', 'b')) == ['1', '2']
+
+            with pytest.raises(bot_module.SessionStoreError, match='Unexpected reply'):
+                await connection.execute(('BADREPLY',), ('HGET', 'h', 'a'))
+            assert connection.writer is None
+            assert await connection.execute(('HGET', 'h', 'b')) == ['2']
+
+            # A command cancelled before its reply arrived must not leave that reply for the next one
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(connection.execute(('SLOWPING',)), 0.05)
+            assert connection.writer is None
+            assert await connection.execute(('HGET', 'h', 'a')) == ['1']
+        finally:
+            connection.close()
+
+    run_with_redis(bot_module, test)
@@ -0,0 +1,78 @@
+import asyncio
+import gc
+import types
+import weakref
+
+class FakeChannel:
+    guild = None
+
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.sent = []
+
+    async def send(self, content=None, embed=None):
+        self.sent.append(embed.description)
+
+def new_session(bot_module, author_id, channel):
+    return {
+        'user': types.SimpleNamespace(id=author_id + 1000, name=f'user{author_id}'),
+        'channel': channel,
+        'dm_channel': None,
+        'message_map': bot_module.MessageMap(author_id)
+    }
+
+def test_reaper_frees_stopped_sessions(bot_module):
+    """A stopped session is not kept alive by its pending expiry, and a new session by the same admin keeps its own deadline"""
+    bot_module.config.update(session_idle_ttl=0.2, session_max_ttl=None)
+    channel = FakeChannel(5)
+
+    async def main():
+        bot_module.transcript_writer.start()
+        bot_module.session_reaper.start()
+        try:
+            await bot_module.start_dm(1, new_session(bot_module, 1, channel))
+            message_map = weakref.ref(bot_module.active_dms[1]['message_map'])
+            await bot_module.stop_dm(1)
+            gc.collect()
+            assert message_map() is None
+
+            # The first session's entry comes due first and must not end the second one
+            await asyncio.sleep(0.1)
+            await bot_module.start_dm(1, new_session(bot_module, 1, channel))
+            await asyncio.sleep(0.15)
+            assert 1 in bot_module.active_dms
+            await asyncio.sleep(0.2)
+            assert 1 not in bot_module.active_dms
+        finally:
+            await bot_module.session_reaper.close()
+            await bot_module.transcript_writer.close()
+
+    asyncio.run(main())
+    assert len(channel.sent) == 1
+
+def test_session_limit_survives_restart(bot_module):
+    """A restored session keeps its original start time, so session_max_ttl still ends it"""
+    bot_module.config.update(persist_sessions=True, session_idle_ttl=None, session_max_ttl=60)
+    bot_module.bot.get_channel = lambda channel_id: FakeChannel(channel_id)
+
+    async def main():
+        channel = FakeChannel(5)
+        dm_info = new_session(bot_module, 1, channel)
+        dm_info['started_at'] = bot_module.time.time() - 3600
+        await bot_module.start_dm(1, dm_info)
+        bot_module.active_dms.clear()
+        bot_module.dm_targets.clear()
+
+        bot_module.transcript_writer.start()
+        bot_module.session_reaper.start()
+        try:
+            await bot_module.restore_sessions()
+            assert int(bot_module.active_dms[1]['started_at']) == int(dm_info['started_at'])
+            await asyncio.sleep(0.05)
+            assert 1 not in bot_module.active_dms
+        finally:
+            await bot_module.session_reaper.close()
+            await bot_module.transcript_writer.close()
+            await bot_module.session_store.close()
+
+    asyncio.run(main())
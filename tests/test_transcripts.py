@@ -0,0 +1,34 @@
+import asyncio
+import json
+import types
+
+def test_export_imports_existing_logs(bot_module):
+    """Daily logs written before the transcript index existed are exported without any new entry being logged"""
+    entry = {'timestamp': '2026-01-01T12:00:00', 'direction': 'inbound', 'author_id': 1, 'target_id': 50,
+             'sender_id': 50, 'message_id': 10, 'relayed_message_id': 11, 'content': 'before the upgrade'}
+    with open('logs/dm_1_20260101.json', 'w', encoding='utf-8') as f:
+        f.write(json.dumps(entry) + '\n')
+    replies = []
+
+    async def send(content=None, file=None):
+        replies.append((content, file.fp.read().decode() if file else None))
+        if file:
+            file.close()
+
+    ctx = types.SimpleNamespace(
+        guild=types.SimpleNamespace(id=900, filesize_limit=8388608),
+        author=types.SimpleNamespace(id=1),
+        send=send
+    )
+
+    async def main():
+        bot_module.transcript_writer.start()
+        try:
+            await bot_module.send_transcript_export(ctx, 'transcripts_50', target_id=50)
+        finally:
+            await bot_module.transcript_writer.close()
+
+    asyncio.run(main())
+    (content, exported), = replies
+    assert content == "Here are the matching chat logs:"
+    assert json.loads(exported)['content'] == 'before the upgrade'